@@ -0,0 +1,234 @@
+"""
+Benchmarks of jobchain's own overhead.
+
+Generates a synthetic job description (repositories, jobs, templates, variables and function expressions) with no-op
+step runners, then measures the description loading, the template merging, the variable parsing, the expression
+resolving, the end-to-end execution and the startup of the command line (a fresh interpreter importing jobchain.cli).
+
+Usage:
+    python benchmarks/bench.py                  # run and print the results
+    python benchmarks/bench.py --save           # run and save the results as the baseline
+    python benchmarks/bench.py --compare        # run and compare with the baseline, exit 1 if regressed
+
+The baseline is only comparable with the same parameters (--repositories, --jobs, --steps and --variables). The
+speed of an interpreter varies with its memory layout (by up to a third between two runs), so the benchmarks run in
+--processes fresh interpreters and the best of them is taken.
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the descriptions cached by the benchmarks MUST NOT touch the user's cache, set before importing jobchain.
+CACHE_DIR = os.environ['JOBCHAIN_CACHE_DIR'] = tempfile.mkdtemp(prefix='jobchain-bench-')
+atexit.register(shutil.rmtree, CACHE_DIR, True)
+
+import jobchain.step as steps  # noqa: E402
+from jobchain.job_description import JobDescription  # noqa: E402
+from jobchain.job_executor import JobExecutor  # noqa: E402
+from jobchain.logger import logger  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# the parameters of the generated description, the results are only comparable with the same ones.
+PARAMETERS = ('repositories', 'jobs', 'steps', 'variables')
+# the min time of a repetition of a benchmark, in seconds.
+MIN_TIME = 0.1
+
+
+def generate(repositories: int, jobs: int, steps_per_job: int, variables: int) -> str:
+    lines = ['template:']
+    for k in range(steps_per_job):
+        lines += [f'  noop.s{k}:',
+                  f'    name: template-{k}',
+                  f'    labels: [a, b, c]']
+    lines.append('variable:')
+    for k in range(variables):
+        lines += [f'  var_{k}:',
+                  f'    parser: "$split({{}});"',
+                  f'    value: "v{k} w{k} x{k}"']
+    lines.append('repositories:')
+    for i in range(repositories):
+        lines.append(f'  repo-{i}:')
+        for j in range(jobs):
+            lines.append(f'    job-{j}:')
+            lines += _steps(steps_per_job, variables)
+    # the jobs exposing the parser to the benchmarks through the '__parser' parameter of the 'capture' step.
+    lines += ['  bench:',
+              '    variables:',
+              '      capture:',
+              '        values: [' + ', '.join(f'"${{var_{k}}}"' for k in range(variables)) + ']',
+              '    resolve:']
+    lines += _steps(steps_per_job, variables)
+    lines.append('      capture:')
+    return '\n'.join(lines) + '\n'
+
+
+def _steps(steps_per_job: int, variables: int) -> list:
+    lines = []
+    for k in range(steps_per_job):
+        lines.append(f'      noop.s{k}:')
+        lines.append(f'        value: "${{0.context.repository}}-${{var_{k % variables}}}"')
+        if k > 0:
+            lines.append(f'        previous: "${{{k}.value}}"')
+            lines.append(f'        count: "$eval(len(${{{k}.items}}));"')
+        lines.append(f'        items: "$split(${{var_{k % variables}}});"')
+    return lines
+
+
+def measure(fn, repeat: int, setup=None) -> dict:
+    """
+    Returns the best time of fn per call, setup (if given) prepares the argument of each call, it's not timed. Like
+    timeit's autorange, each repetition calls fn enough times to take MIN_TIME seconds, a short benchmark isn't
+    dominated by the timer and the scheduler noise.
+    """
+    arguments = (lambda: (setup(),)) if setup else (lambda: ())
+
+    def run(number: int) -> float:
+        elapsed = 0
+        for _ in range(number):
+            args = arguments()
+            start = time.perf_counter()
+            fn(*args)
+            elapsed += time.perf_counter() - start
+        return elapsed
+
+    fn(*arguments())  # warm up
+    number = 1
+    while run(number) < MIN_TIME:
+        number *= 2
+    timings = [run(number) / number for _ in range(repeat)]
+    args = arguments()
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(timings)
+    return {'seconds': best, 'ops_per_second': 1 / best if best else float('inf'), 'peak_kib': peak / 1024}
+
+
+def import_cli():
+    subprocess.run([sys.executable, '-c', 'import jobchain.cli'], check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_benchmarks(args) -> dict:
+    steps.noop = types.SimpleNamespace(run=lambda value=None, items=None, previous=None, count=None: {
+        'value': value, 'items': items})
+    parsers = []
+
+    def capture(__parser):
+        parsers[:] = [__parser]
+
+    steps.capture = types.SimpleNamespace(run=capture)
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as f:
+        f.write(generate(args.repositories, args.jobs, args.steps, args.variables))
+    try:
+        description = JobDescription(f.name, cache=False)
+        pairs = description.job_names()
+        repository, job = 'repo-0', 'job-0'
+        # the parser of the executed job, it resolves the expressions with the step results of the job.
+        JobExecutor(description, 'bench', 'resolve', {}).execute()
+        parse = parsers[0]
+        step_params = list(description.job(repository, job).values())
+
+        def execute():
+            JobExecutor(description, repository, job, {}).execute()
+
+        benchmarks = {
+            'load': (lambda: JobDescription(f.name, cache=False), None),
+            'load_cached': (lambda: JobDescription(f.name), None),
+            # the merged jobs are memoized by the description, merge them with a freshly loaded one.
+            'job_merge': (lambda loaded: [loaded.job(r, j) for r, j in pairs], lambda: JobDescription(f.name)),
+            # the variables are parsed lazily, the step of the job references all of them.
+            'parse_variables': (lambda: JobExecutor(description, 'bench', 'variables', {}).execute(), None),
+            'resolve_context': (lambda: [parse(params) for params in step_params], None),
+            'execute': (execute, None),
+            'import_cli': (import_cli, None)
+        }
+        return {name: measure(fn, args.repeat, setup=setup) for name, (fn, setup) in benchmarks.items()
+                if not args.only or name in args.only}
+    finally:
+        os.remove(f.name)
+
+
+def run_processes(args) -> dict:
+    """
+    Runs the benchmarks in the fresh interpreters, returns the best result of each benchmark.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--repeat', str(args.repeat)]
+    command += [item for name in PARAMETERS for item in (f'--{name}', str(getattr(args, name)))]
+    command += ['--only', *args.only] if args.only else []
+    best = {}
+    for _ in range(args.processes):
+        out = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        for name, result in json.loads(out).items():
+            if name not in best or result['seconds'] < best[name]['seconds']:
+                best[name] = result
+    return best
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    ok = True
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[name]['seconds']
+        regressed = ratio > 1 + tolerance
+        ok = ok and not regressed
+        print(f'{name:20} {ratio:6.2f}x of baseline {"REGRESSED" if regressed else ""}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmarks of jobchain overhead')
+    parser.add_argument('--repositories', type=int, default=200)
+    parser.add_argument('--jobs', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--variables', type=int, default=50)
+    parser.add_argument('--only', nargs='+', metavar='name', help='run only the given benchmarks')
+    parser.add_argument('--baseline', default=BASELINE, help='the baseline file')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare with the baseline, exit 1 if regressed')
+    parser.add_argument('--repeat', type=int, default=5, help='the repetitions of each benchmark in a process')
+    parser.add_argument('--processes', type=int, default=3, help='the interpreters running the benchmarks, default 3')
+    # runs the benchmarks in this process and prints the results as JSON, for run_processes.
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='the allowed slowdown ratio, default 0.5')
+    args = parser.parse_args()
+
+    if args.child:
+        logger.setLevel(logging.WARNING)
+        print(json.dumps(run_benchmarks(args)))
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        recorded = {name: baseline['parameters'].get(name) for name in PARAMETERS}
+        if recorded != {name: getattr(args, name) for name in PARAMETERS}:
+            parser.error(f'the baseline was recorded with the other parameters {recorded}')
+
+    results = run_processes(args)
+    for name, result in results.items():
+        print(f'{name:20} {result["seconds"] * 1000:10.3f} ms/op {result["ops_per_second"]:10.1f} op/s '
+              f'{result["peak_kib"]:10.1f} KiB peak')
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'parameters': {name: getattr(args, name) for name in PARAMETERS}, 'results': results}, f,
+                      indent=2)
+    if baseline and not compare(results, baseline['results'], args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
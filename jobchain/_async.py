@@ -0,0 +1,81 @@
+import concurrent.futures
+import contextvars
+import inspect
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def event_loop() -> 'asyncio.AbstractEventLoop':
+    """
+    Returns the event loop shared by the coroutine runners, it runs forever in a daemon thread. asyncio is imported
+    on first use, most jobs have no coroutine runners.
+    """
+    import asyncio
+
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='jobchain-event-loop', daemon=True).start()
+    return _loop
+
+
+def call(func, kwargs: dict, timeout: float = None):
+    """
+    Calls the function with the keyword arguments and returns its result, a coroutine function is driven on the
+    shared event loop. Raises TimeoutError if it's not finished in timeout seconds, the coroutine is cancelled, but a
+    regular function can't be interrupted, it's abandoned in a daemon thread. The errors raised by the function
+    (including its own TimeoutError) are raised as is.
+    """
+    if inspect.iscoroutinefunction(func):
+        import asyncio
+
+        future = asyncio.run_coroutine_threadsafe(func(**kwargs), event_loop())
+    elif timeout is None:
+        return func(**kwargs)
+    else:
+        future = _call_in_thread(func, kwargs)
+    if timeout is not None and not concurrent.futures.wait([future], timeout).done:
+        future.cancel()
+        raise TimeoutError(f'timed out after {timeout} seconds')
+    return future.result()
+
+
+def hedge(func, delay: float):
+    """
+    Calls the function, if it's not finished in delay seconds, calls it again concurrently and takes whichever succeeds
+    first, the other one is abandoned. Raises the error of the first call if both failed.
+
+    Returns:
+        (result, hedged), hedged is True if the result is from the second call.
+    """
+    first = _call_in_thread(func, {})
+    if concurrent.futures.wait([first], delay).done:
+        return first.result(), False
+    second = _call_in_thread(func, {})
+    pending = [first, second]
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                return future.result(), future is second
+    return first.result(), False
+
+
+def _call_in_thread(func, kwargs: dict) -> concurrent.futures.Future:
+    future = concurrent.futures.Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        # noinspection PyBroadException
+        try:
+            future.set_result(func(**kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True).start()
+    return future
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from .version import version
+
+CACHE_DIR = os.environ.get('JOBCHAIN_CACHE_DIR', os.path.join(str(Path.home()), '.cache', 'jobchain'))
+STEP_CACHE_MAX_SIZE = int(os.environ.get('JOBCHAIN_STEP_CACHE_MAX_SIZE', 1 << 30))
+STEP_CACHE_MAX_AGE = float(os.environ.get('JOBCHAIN_STEP_CACHE_MAX_AGE', 7 * 24 * 3600))
+DESCRIPTION_CACHE_MAX_SIZE = int(os.environ.get('JOBCHAIN_DESCRIPTION_CACHE_MAX_SIZE', 64 << 20))
+DESCRIPTION_CACHE_MAX_AGE = float(os.environ.get('JOBCHAIN_DESCRIPTION_CACHE_MAX_AGE', 30 * 24 * 3600))
+HTTP_CACHE_MAX_SIZE = int(os.environ.get('JOBCHAIN_HTTP_CACHE_MAX_SIZE', 64 << 20))
+HTTP_CACHE_MAX_AGE = float(os.environ.get('JOBCHAIN_HTTP_CACHE_MAX_AGE', 30 * 24 * 3600))
+
+
+def digest(*parts) -> str:
+    """
+    Returns the sha256 hex digest of the parts, str parts are encoded as utf-8.
+    """
+    h = hashlib.sha256(version.encode('utf-8'))
+    for part in parts:
+        h.update(b'\0')
+        h.update(part.encode('utf-8') if isinstance(part, str) else part)
+    return h.hexdigest()
+
+
+class DiskCache:
+
+    """
+    A pickle based on-disk cache, each entry is saved as a file named with its key, the creation time is saved before
+    the value. The modification time of the file is the last use, which decides the entries evicted first.
+
+    The cache is best effort, an unreadable or unwritable entry is treated as a miss.
+
+    Attributes:
+        directory (str): the directory of the cache entries
+    """
+    def __init__(self, namespace: str, directory: str = None):
+        self.directory = os.path.join(directory or CACHE_DIR, namespace)
+
+    def get(self, key: str, default=None, max_age: float = None):
+        """
+        Returns the cached value, or the default if missing or created more than max_age seconds ago.
+        """
+        path = self._path(key)
+        # noinspection PyBroadException
+        try:
+            with open(path, 'rb') as f:
+                created = pickle.load(f)
+                if max_age is not None and time.time() - created > max_age:
+                    return default
+                value = pickle.load(f)
+            # keep the recently used entries when evicting.
+            os.utime(path)
+            return value
+        except Exception:
+            return default
+
+    def put(self, key: str, value):
+        temp_path = None
+        # noinspection PyBroadException
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(time.time(), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except Exception:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self, max_size: int = None, max_age: float = None):
+        """
+        Removes the entries older than max_age seconds, then the least recently used ones until the total size is not
+        greater than max_size bytes.
+        """
+        # noinspection PyBroadException
+        try:
+            entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                             for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.startswith('.'))
+        except Exception:
+            return
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if (max_age is not None and now - mtime > max_age) or (max_size is not None and total > max_size):
+                # noinspection PyBroadException
+                try:
+                    os.remove(path)
+                    total -= size
+                except Exception:
+                    pass
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
@@ -0,0 +1,85 @@
+import os
+import shutil
+import threading
+import time
+
+from ._cache import CACHE_DIR, DiskCache
+from ._utils import pid_alive
+
+CHECKPOINT_MAX_AGE = float(os.environ.get('JOBCHAIN_CHECKPOINT_MAX_AGE', 7 * 24 * 3600))
+
+# the run directories used by the executors of the process.
+_active = set()
+_active_lock = threading.Lock()
+
+
+def open_run(job_key: str, resume: bool) -> DiskCache:
+    """
+    Returns the checkpoint of a run of the job, each run has its own directory '<time>-<pid>' under the job key, so the
+    concurrent runs don't share one. A resumed run takes over the latest checkpoint left by a finished (failed) run,
+    the abandoned checkpoints are evicted after CHECKPOINT_MAX_AGE seconds.
+    """
+    evict(CHECKPOINT_MAX_AGE)
+    root = os.path.join(CACHE_DIR, 'checkpoint', job_key)
+    run = f'{time.time_ns()}-{os.getpid()}'
+    with _active_lock:
+        _active.add(os.path.join(root, run))
+    if resume:
+        for path in sorted(_abandoned(root), key=_mtime, reverse=True):
+            try:
+                # the rename is atomic, the other resumed runs can't take over the same checkpoint.
+                os.rename(path, os.path.join(root, run))
+                break
+            except OSError:
+                continue
+    return DiskCache(run, root)
+
+
+def close_run(checkpoint: DiskCache):
+    """
+    Releases the checkpoint of the run, it's kept for resuming unless it's cleared.
+    """
+    with _active_lock:
+        _active.discard(checkpoint.directory)
+
+
+def evict(max_age: float):
+    """
+    Removes the abandoned checkpoints unchanged for max_age seconds.
+    """
+    root = os.path.join(CACHE_DIR, 'checkpoint')
+    now = time.time()
+    try:
+        jobs = [entry.path for entry in os.scandir(root) if entry.is_dir()]
+    except OSError:
+        return
+    for job in jobs:
+        for path in _abandoned(job):
+            if now - _mtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rmdir(job)
+        except OSError:  # not empty
+            pass
+
+
+def _abandoned(root: str) -> list:
+    try:
+        entries = [entry for entry in os.scandir(root) if entry.is_dir()]
+    except OSError:
+        return []
+    with _active_lock:
+        active = set(_active)
+    abandoned = []
+    for entry in entries:
+        pid = entry.name.rpartition('-')[2]
+        if entry.path not in active and not (pid.isdigit() and int(pid) != os.getpid() and pid_alive(int(pid))):
+            abandoned.append(entry.path)
+    return abandoned
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
@@ -0,0 +1,88 @@
+import atexit
+import queue
+import threading
+import time
+
+from .logger import logger
+
+# the queues of the process, flushed by flush_queues.
+_queues = []
+
+
+class BackgroundQueue:
+
+    """
+    Processes the submitted items in a daemon thread, the items submitted in a burst are processed as one batch.
+
+    The pending items are flushed when the interpreter exits, waits at most flush_timeout seconds. A process which
+    exits without the atexit hooks (e.g. a batch worker or a forked daemon run) calls flush_queues when a run finished.
+
+    Attributes:
+        name (str): the name of the worker thread
+        window (float): after the first item arrived, waits the following items for window seconds
+        flush_timeout (float): the max seconds to wait for the pending items at exit
+    """
+    def __init__(self, name: str, process_batch, window: float = 0.2, flush_timeout: float = 60):
+        self.name = name
+        self.window = window
+        self.flush_timeout = flush_timeout
+        self._process_batch = process_batch
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        _queues.append(self)
+        atexit.register(self._flush_pending)
+
+    def submit(self, item):
+        with self._idle:
+            self._pending += 1
+        self._queue.put(item)
+        self._ensure_worker()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until all the submitted items are processed, returns False if timed out.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _flush_pending(self) -> bool:
+        if not self.flush(self.flush_timeout):
+            logger.warning(f'{self._pending} items in {self.name} are not processed in {self.flush_timeout} seconds.')
+            return False
+        return True
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.window
+            while True:
+                remaining = deadline - time.time()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # noinspection PyBroadException
+            try:
+                self._process_batch(batch)
+            except Exception as e:
+                logger.error(f'{self.name} failed to process {len(batch)} items: {e}')
+            with self._idle:
+                self._pending -= len(batch)
+                self._idle.notify_all()
+
+
+def flush_queues() -> bool:
+    """
+    Waits until the items of all the queues are processed (each one at most its flush_timeout seconds), returns False
+    if any of them timed out.
+    """
+    return all([q._flush_pending() for q in list(_queues)])
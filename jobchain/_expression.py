@@ -0,0 +1,173 @@
+import builtins
+import inspect
+import re
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable
+
+import jobchain.event as events
+import jobchain.function as functions
+import jobchain.step as steps
+from ._utils import compile_path, get_nested, optional
+from .exception import StepError, ParseError
+from .job_description import JobDescription
+from .logger import logger
+
+INTERNAL_VARIABLE_PATTERN = r'\$\{((\d+)?(?:\.(?:\w+|\[[\w\.]+\]))*)\}'
+VARIABLE_PATTERN = r'\${([a-zA-Z][\w\-_]+)}'
+FUNC_PATTERN = r'\$([a-zA-Z_]+)\((.*)\);'
+
+ALL_VARIABLE_PATTERN = r'(\$\{\d*(?:\.(?:\w+|\[[\w\.]+\]))*\}|\$\{[a-zA-Z][\w\-_]+\})'
+INTERNAL_VARIABLE_PART = r'(?:[\$\w]+|\[[\w\.]+\])'
+
+# the max number of the compiled template strings and function arguments kept, the least recently used are dropped.
+CACHE_SIZE = 16384
+
+# the namespace the function arguments (e.g. '$eval(re.sub(...));') are evaluated in, the names which were visible to
+# them in the job executor module (JobExecutor is added by it), not the internals introduced since.
+EVAL_GLOBALS = {
+    '__builtins__': builtins, 'inspect': inspect, 're': re, 'Any': Any, 'Callable': Callable, 'events': events,
+    'functions': functions, 'steps': steps, 'get_nested': get_nested, 'optional': optional, 'StepError': StepError,
+    'ParseError': ParseError, 'JobDescription': JobDescription, 'logger': logger,
+    'INTERNAL_VARIABLE_PATTERN': INTERNAL_VARIABLE_PATTERN, 'VARIABLE_PATTERN': VARIABLE_PATTERN,
+    'FUNC_PATTERN': FUNC_PATTERN, 'ALL_VARIABLE_PATTERN': ALL_VARIABLE_PATTERN,
+    'INTERNAL_VARIABLE_PART': INTERNAL_VARIABLE_PART
+}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_expression(source: str) -> 'Expression':
+    """
+    Returns the pre-parsed expression of the template string, the result is cached by the source string.
+    """
+    return Expression(source)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_arguments(args_str: str, variable_pattern: str):
+    """
+    Compiles the argument expression of a function into a lambda, the placeholders become the lambda parameters. The
+    lambda is evaluated in EVAL_GLOBALS.
+
+    Returns:
+        (placeholders, lambda)
+    """
+    variables = re.findall(variable_pattern, args_str)
+    if not variables:
+        return (), eval(f'lambda: [{args_str}]', EVAL_GLOBALS)
+
+    mapped_variables = {name: f'_var_{i}' for i, name in enumerate(dict.fromkeys(variables))}
+    names = tuple(mapped_variables.keys())
+    generated_args = ", ".join(mapped_variables.values())
+    generated_body = re.sub(variable_pattern, lambda vm: mapped_variables[vm.group(1)], args_str)
+    generated_lambda = f'lambda {generated_args}: [{generated_body}]'
+    logger.debug('Resolving the argument expression: %s\n\tGenerated argument resolver: %s', args_str, generated_lambda)
+    return names, eval(generated_lambda, EVAL_GLOBALS)
+
+
+def references(value) -> set:
+    """
+    Returns the step indexes referenced by the internal variables (e.g. '${1.x}') in the value, it can be a template
+    string or a list/dict (or a frozen one) contains template strings.
+    """
+    if type(value) == str:
+        return compile_expression(value).references
+    elif isinstance(value, (list, tuple)):
+        return set().union(*[references(item) for item in value])
+    elif isinstance(value, (dict, MappingProxyType)):
+        return set().union(*[references(item) for item in value.values()])
+    return set()
+
+
+def subscriptions(value, index: int) -> int:
+    """
+    Returns how many times the whole result of the step is referenced (e.g. '${2}') in the value.
+    """
+    if type(value) == str:
+        return value.count(f'${{{index}}}')
+    elif isinstance(value, (list, tuple)):
+        return sum(subscriptions(item, index) for item in value)
+    elif isinstance(value, (dict, MappingProxyType)):
+        return sum(subscriptions(item, index) for item in value.values())
+    return 0
+
+
+def internal_path(path: str) -> list:
+    """
+    Splits the path of an internal variable, e.g. '1.a.[b.c]' into ['$1', 'a', 'b.c'].
+    """
+    return [x.strip('[]') for x in re.findall(INTERNAL_VARIABLE_PART, f'${path}')]
+
+
+class Expression:
+
+    """
+    A template string parsed into a closure.
+
+    The closure is evaluated against a resolver (the job executor) which supplies the values of the placeholders:
+        resolver._internal_value(accessor, scoped_variables) for '${1.x}', the accessor is compiled from the path
+        resolver._variable_value(name) for '${var}'
+        resolver._function_value(func_name, args_str, scoped_variables) for '$func(...);'
+
+    Attributes:
+        source (str): the template string
+        references (set): the step indexes referenced by the internal variables, includes the ones in function arguments
+    """
+    def __init__(self, source: str):
+        self.source = source
+        self.references = {int(idx) for _, idx in re.findall(INTERNAL_VARIABLE_PATTERN, source) if idx}
+        self._evaluate = _compile(source)
+
+    def evaluate(self, resolver, scoped_variables: dict=None):
+        return self._evaluate(resolver, scoped_variables)
+
+
+def _compile(source: str):
+    matcher = re.fullmatch(INTERNAL_VARIABLE_PATTERN, source)
+    if matcher:
+        return _internal_variable(matcher)
+    matcher = re.fullmatch(VARIABLE_PATTERN, source)
+    if matcher:
+        return _variable(matcher)
+    matcher = re.fullmatch(FUNC_PATTERN, source)
+    if matcher:
+        return _function(matcher)
+
+    # treat as a string replace holder
+    parts = _tokenize(source, FUNC_PATTERN, _function,
+                      lambda text: _tokenize(text, INTERNAL_VARIABLE_PATTERN, _internal_variable,
+                                             lambda t: _tokenize(t, VARIABLE_PATTERN, _variable, lambda s: [s])))
+    if all(type(part) == str for part in parts):
+        return lambda resolver, scoped_variables: source
+
+    def evaluate(resolver, scoped_variables):
+        return ''.join([part if type(part) == str else str(part(resolver, scoped_variables)) for part in parts])
+    return evaluate
+
+
+def _tokenize(text: str, pattern: str, matched, unmatched) -> list:
+    parts = []
+    pos = 0
+    for m in re.finditer(pattern, text):
+        if m.start() > pos:
+            parts.extend(unmatched(text[pos:m.start()]))
+        parts.append(matched(m))
+        pos = m.end()
+    if pos < len(text):
+        parts.extend(unmatched(text[pos:]))
+    return parts
+
+
+def _internal_variable(m):
+    accessor = compile_path(internal_path(m.group(1)))
+    return lambda resolver, scoped_variables: resolver._internal_value(accessor, scoped_variables)
+
+
+def _variable(m):
+    variable_name, = m.groups()
+    return lambda resolver, scoped_variables: resolver._variable_value(variable_name)
+
+
+def _function(m):
+    func_name, args_str = m.groups()
+    return lambda resolver, scoped_variables: resolver._function_value(func_name, args_str, scoped_variables)
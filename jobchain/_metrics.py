@@ -0,0 +1,191 @@
+import bisect
+import os
+import re
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the concurrent writers are not serialized
+    fcntl = None
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+_SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)(?:\s+\S+)?$')
+_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+class Registry:
+
+    """
+    The counters and histograms of the executions, kept as OpenMetrics samples, so the registries (and the files written
+    by the other runs) are merged by adding up the samples. The histogram buckets are kept non-cumulative, so an
+    observation updates one bucket, they are accumulated when rendered.
+    """
+    def __init__(self):
+        self._families = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, help_text: str, labels: dict, value: float = 1):
+        """
+        Increases the counter 'name', the sample is named 'name_total'.
+        """
+        with self._lock:
+            self._add(name, 'counter', help_text, f'{name}_total', _label_tuple(labels), value)
+
+    def observe(self, name: str, help_text: str, labels: dict, value: float, buckets: tuple = DURATION_BUCKETS):
+        """
+        Observes the value in the histogram 'name'.
+        """
+        label_tuple = _label_tuple(labels)
+        with self._lock:
+            keys = self._buckets.get((name, label_tuple))
+            if keys is None:
+                keys = self._buckets[(name, label_tuple)] = [
+                    (f'{name}_bucket', label_tuple + (('le', _format(bound)),)) for bound in buckets + (float('inf'),)]
+                for sample, bucket_labels in keys:
+                    self._add(name, 'histogram', help_text, sample, bucket_labels, 0)
+            self._add(name, 'histogram', help_text, *keys[bisect.bisect_left(buckets, value)], 1)
+            self._add(name, 'histogram', help_text, f'{name}_sum', label_tuple, value)
+            self._add(name, 'histogram', help_text, f'{name}_count', label_tuple, 1)
+
+    def merge(self, other: 'Registry'):
+        for name, family in other.snapshot().items():
+            with self._lock:
+                for (sample, labels), value in family['samples'].items():
+                    self._add(name, family['type'], family['help'], sample, labels, value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: {**family, 'samples': dict(family['samples'])} for name, family in self._families.items()}
+
+    def reset(self):
+        with self._lock:
+            self._families.clear()
+            self._buckets.clear()
+
+    def render(self) -> str:
+        """
+        Returns the samples in the OpenMetrics text format.
+        """
+        lines = []
+        for name, family in self.snapshot().items():
+            lines.append(f'# TYPE {name} {family["type"]}')
+            if family['help']:
+                lines.append(f'# HELP {name} {family["help"]}')
+            cumulative = {}
+            for (sample, labels), value in family['samples'].items():
+                if sample.endswith('_bucket'):
+                    series = (sample, labels[:-1])
+                    value = cumulative[series] = cumulative.get(series, 0) + value
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f'{sample}{{{label_text}}} {_format(value)}' if labels else f'{sample} {_format(value)}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def parse(self, text: str):
+        """
+        Adds the samples in the OpenMetrics text, e.g. the file written by the other runs.
+        """
+        family = None
+        cumulative = {}
+        with self._lock:
+            for line in text.splitlines():
+                if line.startswith('# TYPE '):
+                    name, family_type = line[7:].split(' ', 1)
+                    family = self._family(name, family_type.strip(), '')
+                elif line.startswith('# HELP ') and family is not None:
+                    family['help'] = line[7:].split(' ', 1)[1] if ' ' in line[7:] else ''
+                elif line and not line.startswith('#') and family is not None:
+                    m = _SAMPLE_PATTERN.match(line)
+                    if m:
+                        labels = tuple((k, _unescape(v)) for k, v in _LABEL_PATTERN.findall(m.group(2) or ''))
+                        key = (m.group(1), labels)
+                        value = float(m.group(3))
+                        if key[0].endswith('_bucket'):
+                            # the buckets in the text are cumulative.
+                            series = (key[0], labels[:-1])
+                            value, cumulative[series] = value - cumulative.get(series, 0), value
+                        family['samples'][key] = family['samples'].get(key, 0) + value
+
+    def write(self, path: str):
+        """
+        Merges the samples into the file and resets the registry, the file is locked while merging, so the concurrent
+        runs can write the same file.
+        """
+        with open(path + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = Registry()
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    merged.parse(f.read())
+            merged.merge(self)
+            self.reset()
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.metrics-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(merged.render())
+            os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> 'http.server.HTTPServer':
+        """
+        Serves the samples on http://host:port/metrics in a daemon thread.
+        """
+        # imported on demand, it slows down the start of the command line.
+        import http.server
+
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='jobchain-metrics', daemon=True).start()
+        return server
+
+    def _family(self, name: str, family_type: str, help_text: str) -> dict:
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = {'type': family_type, 'help': help_text, 'samples': {}}
+        return family
+
+    def _add(self, name: str, family_type: str, help_text: str, sample: str, labels: tuple, value: float):
+        samples = self._family(name, family_type, help_text)['samples']
+        key = (sample, labels)
+        samples[key] = samples.get(key, 0) + value
+
+
+# the registry updated by the executors of the process.
+REGISTRY = Registry()
+if hasattr(os, 'register_at_fork'):
+    # a forked worker process (e.g. of the batch) reports its own runs only.
+    os.register_at_fork(after_in_child=REGISTRY.__init__)
+
+
+def _label_tuple(labels: dict) -> tuple:
+    return tuple((k, str(v)) for k, v in labels.items() if v is not None)
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
@@ -0,0 +1,80 @@
+import importlib
+import importlib.machinery
+import importlib.util
+import pkgutil
+import threading
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # python < 3.8
+    entry_points = None
+
+
+class Registry:
+
+    """
+    Lazy registry of the runners (steps, functions and event handlers) of a package.
+
+    The module names are discovered without importing them, a module is imported on its first access. The runners can
+    also be supplied by the third-party distributions through the entry points, for example:
+
+        entry_points={'jobchain.steps': ['deploy = mypackage.deploy']}
+
+    Attributes:
+        package (str): the package name
+        group (str): the entry point group
+    """
+    def __init__(self, package: str, path: list, group: str, private_prefix: str = '_'):
+        self.package = package
+        self.group = group
+        self._path = path
+        self._private_prefix = private_prefix
+        self._modules = None
+        self._entry_points = None
+        self._lock = threading.Lock()
+
+    def names(self) -> list:
+        return sorted(set(self._discover_modules()) | set(self._discover_entry_points()))
+
+    def load(self, name: str):
+        """
+        Returns the runner, raises AttributeError if not found (it's used by the module's __getattr__).
+        """
+        if name in self._discover_modules():
+            return importlib.import_module('.' + name, package=self.package)
+        entry_point = self._discover_entry_points().get(name)
+        if entry_point is not None:
+            return entry_point.load()
+        raise AttributeError(f'module \'{self.package}\' has no attribute \'{name}\'')
+
+    def source(self, name: str):
+        """
+        Returns the source code of the runner without importing it, or None if it's not available.
+        """
+        try:
+            if name in self._discover_modules():
+                spec = importlib.machinery.PathFinder.find_spec(name, self._path)
+            else:
+                entry_point = self._discover_entry_points().get(name)
+                # the parent packages of the module are imported, but not the module itself.
+                spec = entry_point and importlib.util.find_spec(entry_point.value.split(':')[0].strip())
+            return spec.loader.get_source(spec.name)
+        except (ImportError, AttributeError, OSError, ValueError):
+            return None
+
+    def _discover_modules(self) -> set:
+        if self._modules is None:
+            with self._lock:
+                self._modules = {module.name for module in pkgutil.iter_modules(self._path)
+                                 if not module.name.startswith(self._private_prefix)}
+        return self._modules
+
+    def _discover_entry_points(self) -> dict:
+        if self._entry_points is None:
+            with self._lock:
+                found = []
+                if entry_points is not None:
+                    eps = entry_points()
+                    found = eps.select(group=self.group) if hasattr(eps, 'select') else eps.get(self.group, [])
+                self._entry_points = {entry_point.name: entry_point for entry_point in found}
+        return self._entry_points
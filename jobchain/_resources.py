@@ -0,0 +1,202 @@
+import abc
+import contextlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from ._utils import pid_alive
+from .logger import logger
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the slots are shared within the process only
+    fcntl = None
+
+RESOURCES_FILE = os.environ.get('JOBCHAIN_RESOURCES_FILE',
+                                os.path.join(tempfile.gettempdir(), 'jobchain-resources.json'))
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2
+
+_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+def parse_resources(value) -> dict:
+    """
+    Parses the resources, a dict (e.g. {'cpu': 2, 'memory': '4G'}) or a string (e.g. 'cpu=2 memory=4G'), the amounts
+    allow the suffixes K, M, G and T.
+    """
+    if isinstance(value, str):
+        value = dict(pair.split('=', 1) for pair in value.split())
+    assert isinstance(value, dict), f'invalid resources "{value}", it should be an object, e.g. {{cpu: 2, memory: 4G}}'
+    resources = {}
+    for name, amount in value.items():
+        m = re.fullmatch(r'\s*([\d.]+)\s*([kmgt]?)i?b?\s*', str(amount), re.IGNORECASE)
+        assert m, f'invalid amount "{amount}" of the resource "{name}"'
+        resources[name] = float(m.group(1)) * _UNITS[m.group(2).lower()]
+    return resources
+
+
+def machine_capacity() -> dict:
+    """
+    Returns the capacity of the machine, the environment variable JOBCHAIN_RESOURCES (e.g. 'cpu=8 memory=16G gpu=1')
+    overrides the detected cpu count and physical memory. The resources not in the capacity are unlimited.
+    """
+    capacity = {'cpu': float(os.cpu_count() or 1)}
+    try:
+        capacity['memory'] = float(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    except (AttributeError, ValueError, OSError):
+        pass
+    capacity.update(parse_resources(os.environ.get('JOBCHAIN_RESOURCES', '')))
+    return capacity
+
+
+def _fits(used: dict, need: dict, capacity: dict, busy: bool) -> bool:
+    # a request larger than the capacity is admitted once nothing else holds the resources, instead of waiting forever.
+    return not busy or all(used.get(name, 0) + amount <= capacity.get(name, float('inf'))
+                           for name, amount in need.items())
+
+
+class Slots(abc.ABC):
+
+    """
+    Admits the work while the capacity remains, the others wait.
+
+    Attributes:
+        capacity (dict): resource name -> amount
+    """
+    def __init__(self, capacity: dict):
+        self.capacity = capacity
+
+    @contextlib.contextmanager
+    def acquire(self, need: dict, name: str = None):
+        """
+        Holds the resources in the context, waits until they are available.
+        """
+        token = self._try_acquire(need)
+        if token is None:
+            logger.info('%s is waiting for the resources %s', name or 'The work', need)
+            interval = POLL_INTERVAL
+            while token is None:
+                self._wait(interval)
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+                token = self._try_acquire(need)
+        try:
+            yield
+        finally:
+            self._release(token)
+
+    @abc.abstractmethod
+    def _try_acquire(self, need: dict):
+        """
+        Holds the resources and returns the token releasing them, or None if they're not available.
+        """
+
+    @abc.abstractmethod
+    def _release(self, token):
+        pass
+
+    def _wait(self, interval: float):
+        time.sleep(interval)
+
+
+class LocalSlots(Slots):
+
+    """
+    The slots shared by the threads of the process, e.g. the steps of a job which declares its own resources.
+    """
+    def __init__(self, capacity: dict):
+        Slots.__init__(self, capacity)
+        self._holders = {}
+        self._condition = threading.Condition()
+
+    def _try_acquire(self, need: dict):
+        with self._condition:
+            used = _sum(self._holders.values())
+            if not _fits(used, need, self.capacity, bool(self._holders)):
+                return None
+            token = object()
+            self._holders[token] = need
+            return token
+
+    def _release(self, token):
+        with self._condition:
+            self._holders.pop(token, None)
+            self._condition.notify_all()
+
+    def _wait(self, interval: float):
+        with self._condition:
+            self._condition.wait(interval)
+
+
+class MachineSlots(Slots):
+
+    """
+    The slots shared by all the jobchain processes on the machine, the holders are saved in a JSON file guarded by a
+    file lock, the holders of the dead processes are dropped.
+    """
+    def __init__(self, capacity: dict = None, path: str = RESOURCES_FILE):
+        Slots.__init__(self, capacity or machine_capacity())
+        self.path = path
+        self._local = _process_slots(self.capacity) if fcntl is None else None
+
+    def _try_acquire(self, need: dict):
+        if self._local:
+            return self._local._try_acquire(need)
+        with self._locked() as holders:
+            used = _sum(holder['resources'] for holder in holders.values())
+            if not _fits(used, need, self.capacity, bool(holders)):
+                return None
+            token = uuid.uuid4().hex
+            holders[token] = {'pid': os.getpid(), 'resources': need}
+            return token
+
+    def _release(self, token):
+        if self._local:
+            return self._local._release(token)
+        with self._locked() as holders:
+            holders.pop(token, None)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    holders = json.loads(content) if content.strip() else {}
+                except ValueError:
+                    logger.warning(f'The resources file {self.path} is broken, reset it.')
+                    holders = {}
+                holders = {token: holder for token, holder in holders.items() if pid_alive(holder['pid'])}
+                yield holders
+                f.seek(0)
+                f.truncate()
+                json.dump(holders, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def _process_slots(capacity: dict) -> LocalSlots:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LocalSlots(capacity)
+        return _shared
+
+
+def _sum(resources) -> dict:
+    total = {}
+    for item in resources:
+        for name, amount in item.items():
+            total[name] = total.get(name, 0) + amount
+    return total
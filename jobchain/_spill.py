@@ -0,0 +1,110 @@
+import collections.abc
+import contextlib
+import contextvars
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import weakref
+
+from .logger import logger
+
+SPILL_THRESHOLD = int(os.environ.get('JOBCHAIN_SPILL_THRESHOLD', 64 << 20))
+
+# the spilled values loaded in the current scope (e.g. a step), path -> value.
+_loaded = contextvars.ContextVar('jobchain_spill_loaded', default=None)
+
+
+def exceeds(value, limit: int) -> bool:
+    """
+    Returns True if the estimated deep size of the value is greater than limit bytes, stops walking once exceeded.
+    """
+    total = 0
+    seen = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if total > limit:
+            return True
+        if isinstance(item, (str, bytes, bytearray)):
+            continue
+        if isinstance(item, collections.abc.Mapping):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__'):
+            stack.append(vars(item))
+    return False
+
+
+class Spilled:
+
+    """
+    A value saved on disk, get_nested loads it back when it reaches the value. Within a loading scope the value is
+    loaded once, the other references get the same object.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self):
+        loaded = _loaded.get()
+        if loaded is not None and self.path in loaded:
+            return loaded[self.path]
+        with open(self.path, 'rb') as f:
+            value = pickle.load(f)
+        if loaded is not None:
+            loaded[self.path] = value
+        return value
+
+
+@contextlib.contextmanager
+def loading_scope():
+    """
+    Keeps the spilled values loaded in the context until it exits, a nested scope shares the outer one.
+    """
+    if _loaded.get() is not None:
+        yield
+        return
+    token = _loaded.set({})
+    try:
+        yield
+    finally:
+        _loaded.reset(token)
+
+
+class SpillStore:
+
+    """
+    The temporary directory of the spilled values, it's removed when the store is garbage collected.
+    """
+    def __init__(self):
+        self._directory = None
+        self._finalizer = None
+
+    def spill(self, name: str, value) -> Spilled:
+        """
+        Saves the value, returns None if it can't be pickled or written (e.g. the disk is full), then the value is kept
+        in memory.
+        """
+        path = None
+        try:
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix='jobchain-spill-')
+                self._finalizer = weakref.finalize(self, shutil.rmtree, self._directory, True)
+            path = os.path.join(self._directory, name)
+            with open(path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError, OSError) as e:
+            if isinstance(e, OSError):
+                logger.warning(f'Failed to spill the value {name} to disk, keep it in memory: {e}')
+            if path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            return None
+        return Spilled(path)
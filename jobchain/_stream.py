@@ -0,0 +1,148 @@
+import collections
+import threading
+
+from .logger import logger
+
+DEFAULT_BUFFER = 1000
+
+
+class Stream:
+
+    """
+    The result of a step which returned an iterator, the following steps consume it lazily.
+
+    Each reference to the step result subscribes the stream, all the subscribers get all the items. The items are pulled
+    from the source on demand and buffered until all the expected subscribers have consumed them. A subscriber which is
+    ahead of the subscribers of another thread by more than the buffer size waits for them (backpressure), the threads
+    are compared by their most advanced subscriber, so the threads never wait for each other. The subscribers of the
+    same thread (e.g. a step referencing the result twice) and the ones which have not started yet (e.g. the later
+    steps in a sequential job) can't be waited for, the buffer grows for them.
+
+    Attributes:
+        name (str): the name used in the logs, e.g. '$2'
+    """
+    def __init__(self, name: str, source, subscribers: int, buffer: int = DEFAULT_BUFFER):
+        self.name = name
+        self._source = iter(source)
+        self._expected = max(subscribers, 1)
+        self._buffer = max(buffer, 1)
+        self._items = collections.deque()
+        self._base = 0
+        self._exhausted = False
+        self._producing = False
+        self._subscribed = 0
+        self._positions = {}
+        self._owners = {}
+        self._warned = False
+        self._condition = threading.Condition()
+
+    def subscribe(self):
+        with self._condition:
+            if self._subscribed >= self._expected and self._base > 0:
+                logger.warning(f'The stream {self.name} is subscribed more times than expected, '
+                               f'the first {self._base} items are missed.')
+            subscription = _Subscription(self, self._subscribed)
+            self._positions[subscription.id] = self._base
+            self._owners[subscription.id] = threading.get_ident()
+            self._subscribed += 1
+            return subscription
+
+    def skip(self, count: int = 1):
+        """
+        Gives up the expected subscribers which will never subscribe, e.g. a step ignored by its condition, the items
+        are no longer kept for them.
+        """
+        with self._condition:
+            self._expected -= count
+            self._trim()
+
+    def _next(self, subscription_id: int):
+        with self._condition:
+            owner = self._owners[subscription_id] = threading.get_ident()
+            while True:
+                position = self._positions[subscription_id]
+                if position < self._base + len(self._items):
+                    item = self._items[position - self._base]
+                    self._positions[subscription_id] = position + 1
+                    self._trim()
+                    return item
+                if self._exhausted:
+                    raise StopIteration
+                if self._producing or (len(self._items) >= self._buffer and self._lagging(position, owner)):
+                    self._condition.wait()
+                    continue
+                if len(self._items) >= self._buffer and not self._warned:
+                    self._warned = True
+                    logger.warning(f'The stream {self.name} buffered more than {self._buffer} items for the steps '
+                                   f'which have not subscribed it yet.')
+                self._producing = True
+                self._condition.release()
+                try:
+                    item = next(self._source, _END)
+                finally:
+                    self._condition.acquire()
+                    self._producing = False
+                    self._condition.notify_all()
+                if item is _END:
+                    self._exhausted = True
+                else:
+                    self._items.append(item)
+
+    def _unsubscribe(self, subscription_id: int):
+        with self._condition:
+            self._positions.pop(subscription_id, None)
+            self._owners.pop(subscription_id, None)
+            self._trim()
+
+    def _lagging(self, position: int, owner: int) -> bool:
+        # the most advanced position of each other thread, the subscribers of the current thread are not waited for.
+        heads = {}
+        for subscription_id, p in self._positions.items():
+            thread = self._owners[subscription_id]
+            if thread != owner:
+                heads[thread] = max(heads.get(thread, p), p)
+        return any(p < position for p in heads.values())
+
+    def _trim(self):
+        # the items are kept for the subscribers which have not started yet.
+        if self._subscribed < self._expected:
+            return
+        lowest = min(self._positions.values(), default=self._base + len(self._items))
+        while self._base < lowest and self._items:
+            self._items.popleft()
+            self._base += 1
+        self._condition.notify_all()
+
+
+class _Subscription:
+
+    """
+    An iterator over the items of the stream, it MUST be closed once it's no longer consumed, otherwise the items are
+    kept for it.
+    """
+    def __init__(self, stream: Stream, subscription_id: int):
+        self.id = subscription_id
+        self._stream = stream
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        return self._stream._next(self.id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._stream._unsubscribe(self.id)
+
+
+_END = object()
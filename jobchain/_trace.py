@@ -0,0 +1,53 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+
+    """
+    Records the duration of the executor's work, and exports them as a Chrome/Perfetto trace.
+
+    The trace can be opened with chrome://tracing or https://ui.perfetto.dev.
+    """
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': (start - self._origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': args
+            }
+            with self._lock:
+                self._events.append(event)
+
+    def events(self) -> list:
+        with self._lock:
+            return list(self._events)
+
+    def export(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, f)
+
+
+def span(tracer: Tracer, name: str, category: str, **args):
+    """
+    Returns the span of the tracer, or a no-op context if the tracer is None.
+    """
+    return tracer.span(name, category, **args) if tracer else contextlib.nullcontext()
@@ -1,19 +1,97 @@
-import collections
+import collections.abc
+import email.utils
 import os
 import re
-import urllib.request as request
-from collections import deque
+import threading
+import time
+import types
+from functools import lru_cache
+from ._cache import DiskCache, digest, HTTP_CACHE_MAX_SIZE, HTTP_CACHE_MAX_AGE
+from ._spill import Spilled
+from .logger import logger
+
+HTTP_TIMEOUT = float(os.environ.get('JOBCHAIN_HTTP_TIMEOUT', 30))
+HTTP_POOL_SIZE = 8
+
+_session = None
+_session_lock = threading.Lock()
 
 
 def read_data(path):
     if re.match(r'^https?://.+$', path):
-        with request.urlopen(path) as resp:
-            return resp.read().decode('utf-8')
+        return _fetch(path)
     else:
         with open(path, 'rb') as f:
             return f.read()
 
 
+def _fetch(url: str) -> str:
+    """
+    Fetches the url over the pooled connections. The response is cached on disk with its ETag/Last-Modified, a cached
+    one is reused without any request while it's fresh (Cache-Control max-age or Expires), otherwise it's revalidated
+    by a conditional request, a 304 reuses it. If the server is not reachable or fails (5xx), the cached one is used.
+    """
+    import requests
+
+    cache = DiskCache('http')
+    key = digest(url)
+    cached = cache.get(key)
+    if cached and cached['expires'] > time.time():
+        return cached['data']
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    try:
+        r = _get_session().get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        # a client error (4xx) is not recovered by the cached one, e.g. the file was removed.
+        if cached is None or (e.response is not None and e.response.status_code < 500):
+            raise
+        logger.warning(f'Failed to fetch {url} ({e}), using the cached one.')
+        return cached['data']
+    if r.status_code == 304 and cached:
+        cached['expires'] = _expires(r.headers)
+        cache.put(key, cached)
+        return cached['data']
+    data = r.content.decode('utf-8')
+    if r.headers.get('ETag') or r.headers.get('Last-Modified') or _expires(r.headers) > time.time():
+        cache.put(key, {'data': data, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified'),
+                        'expires': _expires(r.headers)})
+        cache.evict(HTTP_CACHE_MAX_SIZE, HTTP_CACHE_MAX_AGE)
+    return data
+
+
+def _expires(headers) -> float:
+    cache_control = headers.get('Cache-Control', '')
+    if re.search(r'no-cache|no-store', cache_control):
+        return 0
+    m = re.search(r'max-age=(\d+)', cache_control)
+    if m:
+        return time.time() + int(m.group(1))
+    if headers.get('Expires'):
+        try:
+            return email.utils.parsedate_to_datetime(headers['Expires']).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return 0
+
+
+def _get_session():
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount('https://', HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+            _session.mount('http://', HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+    return _session
+
+
 def to_native(path):
     return re.sub(r'[/\\]', os.sep.replace('\\', '\\\\'), path)
 
@@ -23,22 +101,74 @@ def optional(value):
 
 
 def get_nested(value: dict, path: [str, list], default=None):
-    if type(path) == str:
-        return _get_nested(value, deque(path.split()), default)
-    else:
-        return _get_nested(value, deque(path), default)
-
-
-def _get_nested(value: collections.Mapping, keys: deque, default=None):
-    if len(keys) > 0:
-        attr = keys.popleft()
-        value = value.get(attr)
-        if len(keys) > 0 and value is not None:
-            if isinstance(value, collections.Mapping):
-                return _get_nested(value, keys, default)
-            if isinstance(value, object):
-                return _get_nested(vars(value), keys, default)
-    return value or default
+    v = compile_path(path.split() if type(path) == str else path)(value)
+    return default if v is None else v
+
+
+def freeze(value):
+    """
+    Returns a read-only copy of the value, the dicts become MappingProxyType views and the lists become tuples.
+    """
+    if isinstance(value, dict):
+        return types.MappingProxyType({k: freeze(v) for k, v in value.items()})
+    elif isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """
+    Returns a mutable copy of a frozen value, the reverse of freeze.
+    """
+    if isinstance(value, types.MappingProxyType):
+        return {k: thaw(v) for k, v in value.items()}
+    elif isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def compile_path(path: list):
+    """
+    Returns the accessor of the path, e.g. ['$1', 'a', 'b'] returns a function gets value['$1']['a']['b'], the keys
+    after the first one are looked up in the mappings or the attributes of the objects, the spilled values are loaded
+    back. The accessors are cached by the path.
+    """
+    return _compile_path(tuple(path))
+
+
+# the max number of the path accessors kept, the least recently used are dropped.
+PATH_CACHE_SIZE = 16384
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def _compile_path(keys: tuple):
+    first, rest = (keys[0], keys[1:]) if keys else (None, ())
+
+    def access(value: collections.abc.Mapping):
+        if first is None:
+            return value
+        value = value.get(first)
+        for key in rest:
+            if isinstance(value, Spilled):
+                value = value.load()
+            if value is None:
+                return None
+            value = value.get(key) if isinstance(value, collections.abc.Mapping) else vars(value).get(key)
+        return value.load() if isinstance(value, Spilled) else value
+    return access
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Returns True if the process exists, e.g. the owner of a lock or a checkpoint.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
 
 def _pattern_to_regex(pattern):
@@ -0,0 +1,76 @@
+import collections.abc
+import threading
+
+from .exception import ParseError
+
+
+class Variables(collections.abc.Mapping):
+
+    """
+    The variables of a job. The given variables are returned as is, unless the 'variable' section defines them, a
+    defined variable is parsed on its first access and memoized, so the unused ones cost nothing, and a variable which
+    fails to parse only raises ParseError when it's used.
+
+    Attributes:
+        definitions (dict): the definitions of the 'variable' section, name -> {parser, value}
+        given (dict): the variables given by the command line
+    """
+    def __init__(self, definitions: dict, given: dict, parse):
+        """
+        Args:
+            parse: parse(name, definition) returns the value of the defined variable, it may access the other
+                variables through this mapping.
+        """
+        self.definitions = {name: definition or {} for name, definition in (definitions or {}).items()
+                            if not name.startswith('_')}
+        self.given = given or {}
+        self._parse = parse
+        self._values = {}
+        self._errors = {}
+        self._resolving = []
+        self._lock = threading.RLock()
+
+    def __getitem__(self, name: str):
+        if name in self._values:
+            return self._values[name]
+        if name not in self.definitions:
+            return self.given[name]
+        with self._lock:
+            if name in self._values:
+                return self._values[name]
+            if name in self._errors:
+                raise self._errors[name]
+            definition = self.definitions[name]
+            if name in self._resolving:
+                chain = ' -> '.join(self._resolving[self._resolving.index(name):] + [name])
+                raise ParseError(name, definition.get('parser'), definition.get('value'),
+                                 f'circular reference {chain}')
+            self._resolving.append(name)
+            try:
+                self._values[name] = self._parse(name, definition)
+            except ParseError as e:
+                self._errors[name] = e
+                raise
+            finally:
+                self._resolving.pop()
+            return self._values[name]
+
+    def __iter__(self):
+        yield from self.given
+        yield from (name for name in self.definitions if name not in self.given)
+
+    def __len__(self):
+        return len(self.given.keys() | self.definitions.keys())
+
+    def resolved(self) -> dict:
+        """
+        Returns the variables resolved so far, the given ones included.
+        """
+        return {**self.given, **self._values}
+
+    def restore(self, values: dict):
+        """
+        Sets the resolved values, e.g. the ones saved by the checkpoint.
+        """
+        with self._lock:
+            self._values.update({name: value for name, value in values.items() if name in self.definitions})
@@ -0,0 +1,114 @@
+import fnmatch
+import multiprocessing.util
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ._dispatch import flush_queues
+from ._metrics import REGISTRY
+from .job_description import JobDescription
+from .job_executor import JobExecutor
+from .logger import flush, logger, shutdown
+
+_job_description = None
+
+
+class BatchResult:
+
+    """
+    The result of a job run in a batch.
+
+    Attributes:
+        repository (str): repository name
+        job (str): job name
+        variables (dict): the variables passed to the job
+        error (str): error message, None if the job succeeded
+        duration (float): the elapsed seconds
+        metrics (str): the metrics of the run collected by the worker process, in the OpenMetrics text format
+    """
+    def __init__(self, repository: str, job: str, variables: dict, error: str = None, duration: float = 0):
+        self.repository = repository
+        self.job = job
+        self.variables = variables
+        self.error = error
+        self.duration = duration
+        self.metrics = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> dict:
+        return {
+            'repository': self.repository,
+            'job': self.job,
+            'variables': self.variables,
+            'succeeded': self.succeeded,
+            'error': self.error,
+            'duration': self.duration
+        }
+
+
+def expand_pairs(job_description: JobDescription, patterns: list) -> list:
+    """
+    Expands the 'repository:job' patterns (supports the shell-style wildcards) into (repository, job) pairs.
+    """
+    pairs = []
+    for pattern in patterns:
+        assert ':' in pattern, f'invalid batch item "{pattern}", the format should be "repository:job"'
+        repository_pattern, job_pattern = pattern.split(':', 1)
+        matched = [(r, j) for r, j in job_description.job_names()
+                   if fnmatch.fnmatchcase(r, repository_pattern) and fnmatch.fnmatchcase(j, job_pattern)]
+        assert matched, f'Not found any job matches "{pattern}"'
+        pairs.extend(pair for pair in matched if pair not in pairs)
+    return pairs
+
+
+def run_batch(job_description: JobDescription, runs: list, max_workers: int = None, parallel: int = None) -> list:
+    """
+    Executes the runs across a process pool, the job description is parsed once and shared by the workers.
+
+    Args:
+        job_description (JobDescription): the shared job description
+        runs (list): list of (repository, job, variables)
+        max_workers (int): the max number of worker processes
+        parallel (int): passed to JobExecutor.execute of each run
+
+    Returns:
+        The BatchResult list, as the order of the runs.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(job_description,)) as pool:
+        futures = [pool.submit(_run, repository, job, variables, parallel) for repository, job, variables in runs]
+        results = [future.result() for future in futures]
+    for result in results:
+        if result.metrics:
+            REGISTRY.parse(result.metrics)
+
+    for result in results:
+        status = 'SUCCESS' if result.succeeded else f'FAILURE ({result.error})'
+        logger.info(f'{result.repository}:{result.job} {result.variables or ""} {status} in {result.duration:.2f}s')
+    logger.info(f'Batch finished, {sum(1 for r in results if r.succeeded)}/{len(results)} succeeded.')
+    return results
+
+
+def _init_worker(job_description: JobDescription):
+    global _job_description
+    _job_description = job_description
+    # the worker process exits without the atexit hooks, the queued records are handled by the finalizer.
+    multiprocessing.util.Finalize(None, shutdown, exitpriority=0)
+
+
+def _run(repository: str, job: str, variables: dict, parallel: int = None) -> BatchResult:
+    start = time.time()
+    # noinspection PyBroadException
+    try:
+        JobExecutor(_job_description, repository, job, dict(variables)).execute(parallel)
+        result = BatchResult(repository, job, variables, duration=time.time() - start)
+    except Exception as e:
+        result = BatchResult(repository, job, variables, f'{type(e).__name__}: {e}', time.time() - start)
+    # the metrics of the worker process are merged by the parent.
+    result.metrics = REGISTRY.render()
+    REGISTRY.reset()
+    # the worker process exits without the atexit hooks, don't leave the notifications and the logs of the run behind.
+    flush_queues()
+    flush()
+    return result
@@ -1,9 +1,20 @@
 import argparse
+import cProfile
+import itertools
+import json
+import logging
+import os
 import re
+import signal
 import sys
 
-from .job_description import JobDescription
-from .job_executor import JobExecutor
+from ._metrics import REGISTRY
+from .logger import JsonFormatter, StepFileHandler, add_handler
+
+# the modules of the run modes (daemon, batch, work queue and the executor itself) are imported by the branches of
+# main() that need them, the startup of a command doesn't pay for the others.
+
+ENV_KEY_REGEX = r'[\w.-]+'
 
 
 class EnvironmentVariableAction(argparse.Action):
@@ -35,9 +46,32 @@ class EnvironmentVariableAction(argparse.Action):
 def create_parser():
     parser = argparse.ArgumentParser(description='jenkins job executor',
                                      formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('-f', '--file', required=True, help='file path/url of job description')
-    parser.add_argument('-r', '--repository', required=True, help='repository name')
-    parser.add_argument('-j', '--job', required=True, help='job name')
+    parser.add_argument('-f', '--file', help='file path/url of job description')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always parse the job description, instead of reusing the parsed one cached on disk.')
+    parser.add_argument('-r', '--repository', help='repository name')
+    parser.add_argument('-j', '--job', help='job name')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='save the result of each succeeded step, so the job can be resumed if it failed.')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume the failed job, the succeeded steps of the last execution are skipped.')
+    parser.add_argument('-p', '--parallel', type=int, metavar='N',
+                        help='run the independent steps concurrently with at most N threads.')
+    parser.add_argument('--profile', metavar='path',
+                        help='write the time spent in each step (resolving, condition, run) and event handler\n'
+                             'into a Chrome/Perfetto trace JSON file.')
+    parser.add_argument('--cprofile', metavar='path',
+                        help='profile the execution with cProfile (the main thread only), and dump the stats into the file.')
+    parser.add_argument('--metrics', metavar='path',
+                        help='merge the metrics (step durations, failures, handler latencies ...) of the run into the\n'
+                             'file in the OpenMetrics text format, the file accumulates the metrics of the runs.')
+    parser.add_argument('--metrics-port', type=int, metavar='port',
+                        help='serve the metrics on http://127.0.0.1:port/metrics, e.g. for --serve and --worker.')
+    parser.add_argument('--log-dir', metavar='directory',
+                        help='write the logs of each step into its own file "<index>-<step>.log" under the directory.')
+    parser.add_argument('--log-json', metavar='path',
+                        help='write the logs as JSON lines (with the step name, alias and index) into the file,\n'
+                             '"-" means stderr.')
     env_group = parser.add_argument_group(
         'overwrite the json attributes, or supply the env variables')
     env_group.add_argument('-d', nargs=argparse.ONE_OR_MORE, action=EnvironmentVariableAction, default=dict(),
@@ -46,21 +80,183 @@ def create_parser():
     env_group.add_argument('-e', nargs=argparse.ONE_OR_MORE, action=EnvironmentVariableAction, default=dict(),
                            metavar='variable=value',
                            help='for example: -e release_version=1.0.0.Beta')
+    daemon_group = parser.add_argument_group('keep the job descriptions and the step scripts loaded in a daemon')
+    daemon_group.add_argument('--serve', metavar='socket', help='start the daemon listening on the Unix socket.')
+    daemon_group.add_argument('--connect', metavar='socket',
+                              help='run the job (-f/-r/-j/-d/-e/-p/--checkpoint/--resume) in the daemon listening on the Unix socket.')
+    batch_group = parser.add_argument_group('run many jobs in one invocation, instead of the -r/-j pair')
+    batch_group.add_argument('-b', '--batch', nargs=argparse.ONE_OR_MORE, metavar='repository:job',
+                             help='the jobs to run, allowed the shell-style wildcards,\n'
+                                  'for example: -b "bamboo-*:daily" framework:start-release')
+    batch_group.add_argument('-m', '--matrix', action='append', metavar='"variable=value ..."',
+                             help='a set of variables, each job runs once per set,\n'
+                                  'for example: -m "release_version=1.0.0" -m "release_version=2.0.0"')
+    batch_group.add_argument('-w', '--workers', type=int, metavar='N', help='the max number of worker processes.')
+    batch_group.add_argument('--report', metavar='path', help='write the batch results into a JSON file.')
+    queue_group = parser.add_argument_group('run the jobs by the workers of this machine through a local work queue')
+    queue_group.add_argument('--enqueue', metavar='queue',
+                             help='put the job (-r/-j) or the jobs (-b/-m) into the work queue,\n'
+                                  'for example: --enqueue sqlite:///var/lib/jobchain/queue.db')
+    queue_group.add_argument('--wait', action='store_true',
+                             help='wait until the enqueued jobs finished, --report writes their results.')
+    queue_group.add_argument('--worker', metavar='queue', help='run the jobs leased from the work queue.')
+    queue_group.add_argument('--drain', action='store_true', help='stop the worker once the work queue is empty.')
+    queue_group.add_argument('--lease', type=float, default=60, metavar='seconds',
+                             help='the lease of a job, a job of a lost worker is leased again after it expired.')
+    queue_group.add_argument('--retention', type=float, default=None, metavar='seconds',
+                             help='the workers remove the jobs finished more than the seconds ago (a week by default).')
+    queue_group.add_argument('--max-attempts', type=int, default=3, metavar='N',
+                             help='the max number of the leases of a job, including the ones of the lost workers.')
     return parser
 
 
+def _parse_matrix(matrix: list) -> list:
+    def parse(item: str):
+        variables = {}
+        for pair in re.split(r'\s+', item.strip()):
+            m = re.match(f'^({ENV_KEY_REGEX})=(.*)$', pair)
+            assert m, f'invalid matrix item "{item}", the format should be "variable=value ..."'
+            variables[m.group(1)] = m.group(2)
+        return variables
+
+    return [parse(item) for item in matrix] if matrix else [{}]
+
+
 def _execute(**kwargs):
+    from ._trace import Tracer
+    from .job_description import JobDescription
+    from .job_executor import JobExecutor
+
+    args = kwargs.copy()
+    tracer = Tracer() if args.get('profile') else None
+    profiler = cProfile.Profile() if args.get('cprofile') else None
+    if profiler:
+        profiler.enable()
+    try:
+        job_description = JobDescription(args["file"], args.get('d'), not args.get('no_cache'))
+        job_executor = JobExecutor(job_description, args['repository'], args.get('job'), args.get('e'), tracer)
+        job_executor.execute(args.get('parallel'), checkpoint=args.get('checkpoint'), resume=args.get('resume'))
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args['cprofile'])
+        if tracer:
+            tracer.export(args['profile'])
+
+
+def _execute_batch(**kwargs) -> bool:
+    from .batch import expand_pairs, run_batch
+    from .job_description import JobDescription
+
     args = kwargs.copy()
-    job_description = JobDescription(args["file"], args.get('d'))
-    job_executor = JobExecutor(job_description, args['repository'], args.get('job'), args.get('e'))
-    job_executor.execute()
+    job_description = JobDescription(args["file"], args.get('d'), not args.get('no_cache'))
+    runs = [(repository, job, {**(args.get('e') or {}), **variables})
+            for (repository, job), variables in itertools.product(expand_pairs(job_description, args['batch']),
+                                                                  _parse_matrix(args.get('matrix')))]
+    results = run_batch(job_description, runs, args.get('workers'), args.get('parallel'))
+    if args.get('report'):
+        with open(args['report'], 'w') as f:
+            json.dump([result.to_dict() for result in results], f, indent=2)
+    return all(result.succeeded for result in results)
+
+
+def _enqueue(**kwargs) -> bool:
+    from .batch import expand_pairs
+    from .job_description import JobDescription
+    from .work_queue import open_queue, wait
+
+    args = kwargs.copy()
+    job_description = JobDescription(args["file"], args.get('d'), not args.get('no_cache'))
+    pairs = expand_pairs(job_description, args['batch']) if args.get('batch') else [(args['repository'], args['job'])]
+    file = args['file'] if re.match(r'^https?://', args['file']) else os.path.abspath(args['file'])
+    queue = open_queue(args['enqueue'])
+    task_ids = [queue.put({'file': file, 'repository': repository, 'job': job, 'd': args.get('d'),
+                           'e': {**(args.get('e') or {}), **variables}, 'parallel': args.get('parallel')},
+                          args['max_attempts'])
+                for (repository, job), variables in itertools.product(pairs, _parse_matrix(args.get('matrix')))]
+    if not args.get('wait'):
+        return True
+    statuses = wait(queue, task_ids)
+    if args.get('report'):
+        with open(args['report'], 'w') as f:
+            json.dump(statuses, f, indent=2)
+    for status in statuses:
+        if status['status'] != 'succeeded':
+            sys.stderr.write(f'[ERROR] {status["run"]["repository"]}:{status["run"]["job"]} failed on '
+                             f'{status["worker"]}... message: {status["error"]}\n')
+    return all(status['status'] == 'succeeded' for status in statuses)
+
+
+def _configure_logging(log_dir: str = None, log_json: str = None):
+    if log_dir:
+        add_handler(StepFileHandler(log_dir))
+    if log_json:
+        handler = logging.StreamHandler() if log_json == '-' else logging.FileHandler(log_json, encoding='utf-8')
+        handler.setFormatter(JsonFormatter())
+        add_handler(handler)
+
+
+def _terminate(signum, frame):
+    # the commands run in their own sessions, they don't receive the signal of the terminal or the parent. no command
+    # was started if the process module isn't even imported yet.
+    process = sys.modules.get(f'{__package__}.process')
+    if process:
+        process.kill_running()
+    if signum == signal.SIGINT:
+        raise KeyboardInterrupt
+    sys.exit(128 + signum)
 
 
 def main():
-    parsed_args = create_parser().parse_args()
+    parser = create_parser()
+    parsed_args = parser.parse_args()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, _terminate)
+    _configure_logging(parsed_args.log_dir, parsed_args.log_json)
+    if parsed_args.metrics_port:
+        REGISTRY.serve(parsed_args.metrics_port)
+    if parsed_args.serve:
+        from .daemon import serve
+
+        serve(parsed_args.serve)
+        return
+    if parsed_args.worker:
+        from .work_queue import RETENTION, open_queue, work
+
+        retention = RETENTION if parsed_args.retention is None else parsed_args.retention
+        try:
+            work(open_queue(parsed_args.worker), parsed_args.lease, drain=parsed_args.drain, retention=retention)
+        finally:
+            if parsed_args.metrics:
+                REGISTRY.write(parsed_args.metrics)
+        return
+    if not parsed_args.file:
+        parser.error('the following arguments are required: -f/--file')
+    if not parsed_args.batch and not (parsed_args.repository and parsed_args.job):
+        parser.error('the following arguments are required: -r/--repository, -j/--job (or -b/--batch)')
     # noinspection PyBroadException
     try:
-        _execute(**(vars(parsed_args)))
+        if parsed_args.connect:
+            from .daemon import submit
+
+            request = {key: value for key, value in vars(parsed_args).items()
+                       if key in ('file', 'repository', 'job', 'd', 'e', 'parallel', 'checkpoint', 'resume',
+                                  'no_cache')}
+            request['file'] = parsed_args.file if re.match(r'^https?://', parsed_args.file) \
+                else os.path.abspath(parsed_args.file)
+            if not submit(parsed_args.connect, request):
+                sys.exit(1)
+        elif parsed_args.enqueue:
+            if not _enqueue(**(vars(parsed_args))):
+                sys.exit(1)
+        elif parsed_args.batch:
+            if not _execute_batch(**(vars(parsed_args))):
+                sys.exit(1)
+        else:
+            _execute(**(vars(parsed_args)))
     except Exception as e:
         sys.stderr.write(f'[ERROR] failed... type: {type(e)}\n        message: {e}')
         raise
+    finally:
+        if parsed_args.metrics:
+            REGISTRY.write(parsed_args.metrics)
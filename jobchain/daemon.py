@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import re
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+
+import jobchain.event as events
+import jobchain.function as functions
+import jobchain.step as steps
+from ._dispatch import flush_queues
+from ._expression import references
+from ._metrics import REGISTRY
+from .job_description import JobDescription
+from .job_executor import JobExecutor
+from .logger import add_handler, config, flush, logger
+
+# held across loading the description and forking, so no other request thread holds a lock (e.g. an import or the
+# description cache) in the forked process.
+_fork_lock = threading.Lock()
+
+
+class DescriptionCache:
+
+    """
+    Keeps the loaded job descriptions, a description is reloaded once the modification time of any of its files
+    changed. The jobs of a loaded description are merged, their expressions compiled and their step scripts imported,
+    so the forked processes inherit them.
+    """
+    def __init__(self):
+        self._descriptions = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, externals: dict = None, cache: bool = True) -> JobDescription:
+        if re.match(r'^https?://.+$', path):
+            # the remote description is re-read each time (a fresh or unchanged one is served by the HTTP cache), the
+            # parsed one is cached on disk.
+            return _warm(JobDescription(path, externals, cache))
+        key = (os.path.abspath(path), json.dumps(list((externals or {}).items())))
+        with self._lock:
+            loaded = self._descriptions.get(key)
+            if loaded is None or loaded[0] is None or loaded[0] != _modified(loaded[1].sources):
+                description = _warm(JobDescription(path, externals, cache))
+                loaded = (_modified(description.sources), description)
+                self._descriptions[key] = loaded
+            return loaded[1]
+
+
+def _warm(description: JobDescription) -> JobDescription:
+    for repository, job in description.job_names():
+        for step_name, arguments in description.job(repository, job).items():
+            if step_name.startswith('_'):
+                continue
+            references(arguments)
+            name = re.match(JobDescription.STEP_NAME_PATTERN, step_name).group(1)
+            # noinspection PyBroadException
+            try:
+                getattr(steps, name, None)
+            except Exception as e:
+                logger.warning(f'Failed to import the step {name}: {e}')
+    return description
+
+
+def _preload():
+    """
+    Imports all the step, function and event handler scripts, the forked processes inherit them.
+    """
+    for package in (steps, functions, events):
+        for name in package._registry.names():
+            # noinspection PyBroadException
+            try:
+                getattr(package, name)
+            except Exception as e:
+                logger.warning(f'Failed to import {package.__name__}.{name}: {e}')
+
+
+def _modified(sources: list):
+    # None if any source is remote, so the description is re-read each time.
+    if any(re.match(r'^https?://.+$', source) for source in sources):
+        return None
+    return tuple(os.path.getmtime(source) for source in sources)
+
+
+class _StreamHandler(logging.Handler):
+
+    """
+    Sends the log records to the client.
+    """
+    def __init__(self, send):
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter(config['formatters']['short']['format']))
+        self._send = send
+
+    def emit(self, record):
+        # noinspection PyBroadException
+        try:
+            self._send({'log': self.format(record)})
+        except Exception:
+            pass
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        def send(message: dict):
+            self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+        line = self.rfile.readline()
+        if not line:
+            # e.g. the probe of another daemon checking the socket.
+            return
+        request = json.loads(line)
+        with _fork_lock:
+            # noinspection PyBroadException
+            try:
+                job_description = self.server.descriptions.get(request['file'], request.get('d'),
+                                                               not request.get('no_cache'))
+            except Exception as e:
+                logger.error(f'failed... type: {type(e)} message: {e}')
+                send({'status': 'failure', 'error': str(e)})
+                return
+            # the job runs in a forked process, with the working directory and the environment of the client, the
+            # loaded descriptions and the imported step scripts are inherited.
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                os._exit(_run_forked(request, job_description, send, write_fd))
+        os.close(write_fd)
+        with os.fdopen(read_fd, encoding='utf-8') as metrics:
+            REGISTRY.parse(metrics.read())
+        _, status = os.waitpid(pid, 0)
+        if status != 0:
+            send({'status': 'failure', 'error': f'the job process exited abnormally (status {status})'})
+
+
+def _run_forked(request: dict, job_description: JobDescription, send, metrics_fd: int) -> int:
+    """
+    Runs the job in the forked process, the logs (of all the loggers) and the final status are sent to the client.
+
+    Returns:
+        the exit status, 0 if the final status is sent.
+    """
+    # noinspection PyBroadException
+    try:
+        if request.get('env') is not None:
+            os.environ.clear()
+            os.environ.update(request['env'])
+        if request.get('cwd'):
+            os.chdir(request['cwd'])
+        add_handler(_StreamHandler(send))
+        # noinspection PyBroadException
+        try:
+            job_executor = JobExecutor(job_description, request['repository'], request['job'], request.get('e') or {})
+            job_executor.execute(request.get('parallel'), checkpoint=request.get('checkpoint'),
+                                 resume=request.get('resume'))
+            status = {'status': 'success'}
+        except Exception as e:
+            logger.error(f'failed... type: {type(e)} message: {e}')
+            status = {'status': 'failure', 'error': str(e)}
+        # the process exits without the atexit hooks.
+        flush_queues()
+        flush()
+        with os.fdopen(metrics_fd, 'w', encoding='utf-8') as metrics:
+            metrics.write(REGISTRY.render())
+        send(status)
+        return 0
+    except BaseException:
+        return 1
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str):
+        self.descriptions = DescriptionCache()
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+
+    def server_bind(self):
+        # only the owner can connect, the jobs (e.g. the shell steps) run as the daemon user.
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, stat.S_IRUSR | stat.S_IWUSR)
+
+    def verify_request(self, request, client_address) -> bool:
+        uid = _peer_uid(request)
+        if uid is not None and uid != os.getuid():
+            logger.warning(f'Rejected the request of the user {uid}, only the daemon user can submit the jobs.')
+            return False
+        return True
+
+
+def _peer_uid(connection: socket.socket):
+    """
+    Returns the user id of the client, None if it's not supported on the platform (the socket file is still only
+    accessible to the owner).
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def serve(path: str):
+    """
+    Serves the job-run requests on the Unix socket, the descriptions and the step, function and event handler scripts
+    are loaded in the daemon, each job runs in a process forked from it.
+    """
+    assert hasattr(os, 'fork'), 'the daemon is not supported on this platform'
+    if os.path.lexists(path):
+        assert stat.S_ISSOCK(os.lstat(path).st_mode), f'{path} exists and it\'s not a socket'
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left by a daemon which is not running.
+                os.remove(path)
+            else:
+                raise AssertionError(f'another daemon is listening on {path}')
+    _preload()
+    with _Server(path) as server:
+        logger.info(f'Serving on {path}')
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+
+def submit(path: str, request: dict) -> bool:
+    """
+    Sends the job-run request to the daemon, the job runs in the current working directory and with the current
+    environment variables, writes the logs into stderr, returns True if the job succeeded.
+    """
+    request = {**request, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with client.makefile('r', encoding='utf-8') as responses:
+            for line in responses:
+                response = json.loads(line)
+                if 'log' in response:
+                    sys.stderr.write(response['log'] + '\n')
+                elif 'status' in response:
+                    if response['status'] != 'success':
+                        sys.stderr.write(f'[ERROR] failed... message: {response.get("error")}\n')
+                    return response['status'] == 'success'
+    sys.stderr.write('[ERROR] the daemon closed the connection without the status.\n')
+    return False
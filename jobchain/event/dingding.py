@@ -1,16 +1,93 @@
+import os
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
+from .._dispatch import BackgroundQueue
 from ..exception import EventHandlerError
+from ..logger import logger
+
+URL = os.environ.get('JOBCHAIN_DINGDING_URL', 'https://oapi.dingtalk.com/robot/send')
+TIMEOUT = 10
+RETRIES = 3
+BACKOFF = 0.5
+# the errcode of sending too fast.
+RETRYABLE_ERRCODES = {130101}
+
+_session = None
 
 
 def run(access_token: str, selector: str, messages: dict):
     body = messages.get(selector, messages.get('*', {}))
     if body:
-        r = requests.post(f'https://oapi.dingtalk.com/robot/send?access_token={access_token}', json=body)
-        r.json().get('errcode')
+        _queue.submit((access_token, body))
+    return bool(body)
+
+
+def flush(timeout: float = None) -> bool:
+    return _queue.flush(timeout)
+
+
+def _send_batch(items: list):
+    for access_token, body in _coalesce(items):
+        # noinspection PyBroadException
+        try:
+            _send(access_token, body)
+        except Exception as e:
+            logger.error(str(e))
+
+
+def _coalesce(items: list) -> list:
+    """
+    Merges the consecutive text messages sent to the same robot into one message.
+    """
+    coalesced = []
+    for access_token, body in items:
+        if coalesced and coalesced[-1][0] == access_token and _is_text(coalesced[-1][1]) and _is_text(body):
+            last = coalesced[-1][1]
+            coalesced[-1] = (access_token, {**last, 'text': {
+                'content': last['text']['content'] + '\n' + body['text']['content']}})
+        else:
+            coalesced.append((access_token, body))
+    return coalesced
+
+
+def _is_text(body: dict) -> bool:
+    return body.get('msgtype') == 'text' and isinstance(body.get('text'), dict) and 'at' not in body
+
+
+def _send(access_token: str, body: dict):
+    error = None
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            time.sleep(BACKOFF * 2 ** (attempt - 1))
+        try:
+            r = _get_session().post(URL, params={'access_token': access_token}, json=body, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            error = EventHandlerError('dingding', str(e))
+            continue
         if r.status_code == 200:
-            if r.json().get('errcode') != 0:
-                raise EventHandlerError('dingding', r.json().get('errmsg'))
+            errcode = r.json().get('errcode')
+            if errcode == 0:
+                return
+            error = EventHandlerError('dingding', r.json().get('errmsg'))
+            if errcode not in RETRYABLE_ERRCODES:
+                raise error
         else:
-            raise EventHandlerError('dingding', str(r))
-    return bool(body)
+            error = EventHandlerError('dingding', str(r))
+            if r.status_code < 500 and r.status_code != 429:
+                raise error
+    raise error
+
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        _session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return _session
+
+
+_queue = BackgroundQueue('jobchain-dingding', _send_batch)
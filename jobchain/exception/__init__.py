@@ -7,12 +7,14 @@ class StepError(Exception):
         step (str): step name
         alias (str): step alias name
         message (str): error message
+        attempts (list): the attempts of the step, [{attempt, latency, error, hedged}], if it's retried or hedged
     """
-    def __init__(self, step: str, alias: str, message: str):
+    def __init__(self, step: str, alias: str, message: str, attempts: list = None):
         self.step = step
         self.alias = alias
         self.step_name = step + ('.' + alias if alias else '')
         self.message = message
+        self.attempts = attempts
 
     def __str__(self):
         return f'The step \'{self.step_name}\' failed, error: {self.message}'
@@ -31,6 +33,9 @@ class EventHandlerError(Exception):
         self.handler = handler
         self.message = message
 
+    def __str__(self):
+        return f'The event handler \'{self.handler}\' failed, error: {self.message}'
+
 
 class ParseError(Exception):
 
@@ -52,3 +57,24 @@ class ParseError(Exception):
     def __str__(self):
         return f'Can\'t parsing variable "{self.name}" with the parser "{self.parser}", ' \
                f'the given value is "{self.value}" and the error message is "{self.message}".'
+
+
+class ProcessError(Exception):
+
+    """
+    Exception raised when a command exited with a non-zero status or timed out.
+
+    Attributes:
+        command (str): the command line
+        returncode (int): exit status, negative if killed by a signal
+        output (str): the tail of the stderr (or the stdout if the stderr is empty)
+    """
+    def __init__(self, command: str, returncode: int, output: str, timed_out: bool = False):
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+        self.timed_out = timed_out
+
+    def __str__(self):
+        status = 'timed out' if self.timed_out else f'exited with {self.returncode}'
+        return f'The command \'{self.command}\' {status}' + (f', output:\n{self.output}' if self.output else '')
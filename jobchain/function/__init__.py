@@ -1,7 +1,12 @@
-import os
-import importlib
+from .._registry import Registry
 
-for file in os.listdir(os.path.dirname(__file__)):
-    if not file.startswith('__'):
-        mod_name = file[:-3]   # strip .py at the end
-        importlib.import_module('.' + mod_name, package=__package__)
+_registry = Registry(__name__, __path__, 'jobchain.functions', '__')
+
+
+def __getattr__(name):
+    # the modules are imported on the first access.
+    return _registry.load(name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_registry.names()))
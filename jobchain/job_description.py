@@ -1,19 +1,31 @@
-import collections
+import collections.abc
 import json
+import os
 import re
+import urllib.parse
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 
-from ._utils import read_data
+from ._cache import DiskCache, digest, DESCRIPTION_CACHE_MAX_SIZE, DESCRIPTION_CACHE_MAX_AGE
+from ._utils import freeze, read_data, HTTP_POOL_SIZE
 
+# the libyaml based loader is much faster than the pure python one, the safe loaders don't construct the arbitrary
+# python objects (e.g. !!python/object tags).
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+INCLUDE_KEY = 'include'
 
-def _recursive_update(left: collections.Mapping, *others: collections.Mapping):
+# the top-level 'include' key and its indented (or '- ' prefixed) lines, found without parsing the whole file.
+_INCLUDE_PATTERN = re.compile(rf'^{INCLUDE_KEY}[ \t]*:.*(?:\n(?:[ \t-].*|[ \t]*$))*', re.MULTILINE)
+
+
+def _recursive_update(left: collections.abc.Mapping, *others: collections.abc.Mapping):
     r = {}
     r.update(left)
     for item in others:
         for k, v in item.items():
-            if isinstance(v, collections.Mapping):
+            if isinstance(v, collections.abc.Mapping):
                 r[k] = _recursive_update(r.get(k) or {}, v)
             else:
                 r[k] = v
@@ -30,14 +42,74 @@ def _read_json(json_path, externals: dict = None):
 
 
 def _read_yaml(yaml_path, externals: dict = None):
-    data = read_data(yaml_path)
-    parsed = yaml.load(data)
+    return _parse_yaml(read_data(yaml_path), externals)
+
+
+def _parse_yaml(data, externals: dict = None):
+    parsed = yaml.load(data, Loader=YAML_LOADER)
     if externals:
         for key, value in externals.items():
             _set_nested_attr(parsed, deque(key.split('.')), value)
     return parsed
 
 
+def _includes(path: str, data) -> list:
+    """
+    Returns the paths/urls included by the description, the relative ones are resolved against the path.
+    """
+    text = data.decode('utf-8') if isinstance(data, bytes) else data
+    # a plain substring search is much faster than the multiline regex on a large description.
+    m = None
+    position = text.find(INCLUDE_KEY)
+    while m is None and position != -1:
+        if position == 0 or text[position - 1] == '\n':
+            m = _INCLUDE_PATTERN.match(text, position)
+        position = text.find(INCLUDE_KEY, position + 1)
+    if not m:
+        return []
+    included = yaml.load(m.group(0), Loader=YAML_LOADER)[INCLUDE_KEY] or []
+    included = [included] if isinstance(included, str) else included
+    assert isinstance(included, list), f'invalid "{INCLUDE_KEY}" in "{path}", it should be a path/url or a list of them'
+    return [_resolve_path(path, item) for item in included]
+
+
+def _resolve_path(base: str, path: str) -> str:
+    if re.match(r'^https?://', path) or os.path.isabs(path):
+        return path
+    if re.match(r'^https?://', base):
+        return urllib.parse.urljoin(base, path)
+    return os.path.normpath(os.path.join(os.path.dirname(base), path))
+
+
+def _read_parts(path: str) -> dict:
+    """
+    Reads the description and the ones it includes (recursively), the files of each level are fetched concurrently.
+
+    Returns:
+        path/url -> data, the description first.
+    """
+    parts = {}
+    pending = [path]
+    with ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE) as pool:
+        while pending:
+            for item, data in zip(pending, pool.map(read_data, pending)):
+                parts[item] = data
+            pending = list(dict.fromkeys(included for item in pending for included in _includes(item, parts[item])
+                                         if included not in parts))
+    return parts
+
+
+def _compose(path: str, parts: dict, including: tuple = ()) -> dict:
+    """
+    Merges the included descriptions in order, then the description itself, the later ones override the former.
+    """
+    assert path not in including, f'circular include {" -> ".join(including + (path,))}'
+    parsed = yaml.load(parts[path], Loader=YAML_LOADER) or {}
+    included = [_compose(item, parts, including + (path,)) for item in _includes(path, parts[path])]
+    parsed.pop(INCLUDE_KEY, None)
+    return _recursive_update({}, *included, parsed)
+
+
 def _set_nested_attr(jsontree, paths: deque, value: str):
     if paths:
         attr = paths.popleft()
@@ -54,17 +126,73 @@ def _set_nested_attr(jsontree, paths: deque, value: str):
 class JobDescription:
     STEP_NAME_PATTERN = r'(\w+)(?:\.([\w\.-]+))?'
 
-    def __init__(self, yaml_path, externals: dict = None):
-        self._yaml = _read_yaml(yaml_path, externals)
+    def __init__(self, yaml_path, externals: dict = None, cache: bool = True):
+        """
+        Args:
+            yaml_path (str): file path/url of the job description, it can include the other files/urls by the top-level
+                'include' key, the relative ones are resolved against the description.
+            externals (dict): overwrite the attributes, the keys are the json paths
+            cache (bool): reuse the parsed and checked description saved on disk, the cache key is the hash of the
+                file contents and the externals.
+        """
+        parts = _read_parts(yaml_path)
+        self.sources = list(parts.keys())
+        key = digest(*[item for path, data in parts.items() for item in (path, data)],
+                     json.dumps(list((externals or {}).items())))
+        description_cache = DiskCache('description')
+        parsed = description_cache.get(key) if cache else None
+        if parsed is None:
+            if len(parts) == 1 and not _includes(yaml_path, parts[yaml_path]):
+                parsed = _parse_yaml(parts[yaml_path], externals)
+            else:
+                parsed = _compose(yaml_path, parts)
+                for external_key, value in (externals or {}).items():
+                    _set_nested_attr(parsed, deque(external_key.split('.')), value)
+            self._load(parsed)
+            self._check()
+            if cache:
+                description_cache.put(key, self._yaml)
+                description_cache.evict(DESCRIPTION_CACHE_MAX_SIZE, DESCRIPTION_CACHE_MAX_AGE)
+        else:
+            self._load(parsed)
+
+    def _load(self, parsed: dict):
+        # the merged jobs and the handler chains are memoized, they are shared by the executors (and threads), so
+        # they're frozen.
+        self._jobs = {}
+        self._handlers = {}
+        self._yaml = parsed
         self._repositories = self._yaml.get('repositories')
         self._template = self._yaml.get('template', {})
         self._variable = self._yaml.get('variable', {})
-        self._check()
+
+    def __getstate__(self) -> dict:
+        # the frozen memos can't be pickled (e.g. for the batch workers), they're merged again on demand.
+        return {**vars(self), '_jobs': {}, '_handlers': {}}
 
     def variable_definition(self) -> dict:
         return self._variable
 
+    def job_names(self) -> list:
+        """
+        Returns all the (repository name, job name) pairs, as the original sort.
+        """
+        return [(repository_name, job_name)
+                for repository_name, repository in self._repositories.items() if not repository_name.startswith('_')
+                for job_name in repository.keys() if not job_name.startswith('_')]
+
     def job(self, repository_name: str, job_name: str) -> dict:
+        """
+        Returns the job with the steps merged with the templates, the result is memoized and read-only (the mappings
+        are MappingProxyType views, the lists are tuples).
+        """
+        key = (repository_name, job_name)
+        job = self._jobs.get(key)
+        if job is None:
+            job = self._jobs.setdefault(key, self._merge_job(repository_name, job_name))
+        return job
+
+    def _merge_job(self, repository_name: str, job_name: str) -> dict:
         repository = self._repositories[repository_name]
         assert repository, f'Not found repository \'{repository_name}\''
         assert job_name in repository, f'Not found job \'{job_name}\''
@@ -75,12 +203,20 @@ class JobDescription:
             {step: params or {} for step, params in job.items()}
         )
         # return as the original sort.
-        return {step: merged.get(step) for step, params in job.items()}
-
-    def event_handlers(self, event_name: str, repository_name: str, job_name: str, step_name: str = None) -> list:
-        handler_name = f'_on_{event_name}'
-        return [item.get(handler_name) for item in self._get_objects(repository_name, job_name, step_name) if
-                handler_name in item]
+        return freeze({step: merged.get(step) for step, params in job.items()})
+
+    def event_handlers(self, event_name: str, repository_name: str, job_name: str, step_name: str = None) -> tuple:
+        """
+        Returns the event handlers from the inner scope to the outer, the result is memoized and read-only.
+        """
+        key = (repository_name, job_name, step_name, event_name)
+        handlers = self._handlers.get(key)
+        if handlers is None:
+            handler_name = f'_on_{event_name}'
+            handlers = self._handlers.setdefault(key, tuple(
+                freeze(item.get(handler_name)) for item in self._get_objects(repository_name, job_name, step_name)
+                if handler_name in item))
+        return handlers
 
     def _get_objects(self, repository_name: str, job_name: str, step_name: str = None) -> list:
         items = [self._repositories]
@@ -101,15 +237,15 @@ class JobDescription:
             [JobDescription._check_step_name(step_name) for step_name in job.keys()]
         self._check_event_handlers(self._repositories, 3)
 
-    def _check_event_handlers(self, value: collections.Mapping, level: int):
+    def _check_event_handlers(self, value: collections.abc.Mapping, level: int):
         if level > 0:
             for k, v in value.items():
                 if k.startswith('_on_'):
                     assert 'name' in v, f'Missing name for the event handler \'{k}\'.'
                     assert type(v['name']) == str, f'The name of event handler \'{k}\' MUST be a string.'
                     assert 'args' in v, f'Missing args for the event handler \'{k}\'.'
-                    assert isinstance(v, collections.Mapping), f'The args of event handler \'{k}\' MUST be an object.'
-                if isinstance(v, collections.Mapping):
+                    assert isinstance(v, collections.abc.Mapping), f'The args of event handler \'{k}\' MUST be an object.'
+                if isinstance(v, collections.abc.Mapping):
                     self._check_event_handlers(v, level - 1)
 
     @staticmethod
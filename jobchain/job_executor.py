@@ -1,166 +1,606 @@
+import collections.abc
+import contextlib
+import contextvars
 import inspect
+import itertools
+import json
+import random
 import re
-from typing import Any, Callable
+import threading
+import time
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
 
 import jobchain.event as events
 import jobchain.function as functions
 import jobchain.step as steps
-from ._utils import get_nested, optional
+from ._async import call, hedge
+from ._cache import DiskCache, digest, STEP_CACHE_MAX_SIZE, STEP_CACHE_MAX_AGE
+from ._checkpoint import open_run, close_run
+from ._expression import VARIABLE_PATTERN, FUNC_PATTERN, ALL_VARIABLE_PATTERN, compile_expression, references, \
+    subscriptions, compile_arguments, EVAL_GLOBALS
+from ._metrics import REGISTRY
+from ._resources import LocalSlots, MachineSlots, parse_resources
+from ._spill import SpillStore, SPILL_THRESHOLD, exceeds, loading_scope
+from ._stream import Stream, DEFAULT_BUFFER
+from ._trace import Tracer, span
+from ._utils import optional, thaw
+from ._variables import Variables
 from .exception import StepError, ParseError
 from .job_description import JobDescription
-from .logger import logger
+from .logger import logger, step_context
 
-INTERNAL_VARIABLE_PATTERN = r'\$\{((\d+)?(?:\.(?:\w+|\[[\w\.]+\]))*)\}'
-VARIABLE_PATTERN = r'\${([a-zA-Z][\w\-_]+)}'
-FUNC_PATTERN = r'\$([a-zA-Z_]+)\((.*)\);'
 
-ALL_VARIABLE_PATTERN = r'(\$\{\d*(?:\.(?:\w+|\[[\w\.]+\]))*\}|\$\{[a-zA-Z][\w\-_]+\})'
-INTERNAL_VARIABLE_PART = r'(?:[\$\w]+|\[[\w\.]+\])'
+_MISSING = object()
+# the numeric configuration keys of the steps and their conversions, the resolved values may be strings.
+_NUMERIC_CONFIGS = {'_timeout': float, '_concurrency': int, '_retry': int, '_backoff': float, '_hedge_after': float}
+_source_digests = {}
+# the stream subscriptions opened by the step (or the event handler) being executed, they're closed once it finished.
+_subscriptions = contextvars.ContextVar('jobchain_subscriptions', default=None)
+
+
+@lru_cache(maxsize=None)
+def _parameter_names(func) -> frozenset:
+    return frozenset(inspect.signature(func).parameters.keys())
+
+
+def _source_digest(step_runner):
+    """
+    Returns the digest of the step script source, None if the source is not available.
+    """
+    key = getattr(step_runner, '__name__', id(step_runner))
+    if key not in _source_digests:
+        try:
+            source = inspect.getsource(step_runner)
+        except (TypeError, OSError):
+            try:
+                source = inspect.getsource(step_runner.run)
+            except (TypeError, OSError):
+                source = None
+        _source_digests[key] = digest(source) if source is not None else None
+    return _source_digests[key]
 
 
 class JobExecutor:
 
-    def __init__(self, job_description: JobDescription, repository_name: str, job_name: str, variables: dict=None):
+    def __init__(self, job_description: JobDescription, repository_name: str, job_name: str, variables: dict=None,
+                 tracer: Tracer = None):
         self._job_description = job_description
+        self._tracer = tracer
         self._repository_name = repository_name
         self._job_name = job_name
         self._job = job_description.job(repository_name, job_name)
+        self._variables = variables
+        self._step_cache = None
+        self._checkpoint = None
+        self._saved_variables = -1
+        self._step_names = []
+        self._liveness = None
+        self._spill_store = SpillStore()
+        self._cache_stats = {'hits': 0, 'misses': 0}
+        self._cache_stats_lock = threading.Lock()
+        self._attempts = {}
+        self._slots = None
+        # the expressions evaluated, next() of the counter is atomic.
+        self._resolutions = itertools.count()
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
         self._context = {
             '$': {},
             '$0': {
                 'context': {
                     'repository': repository_name,
                     'job': job_name
-                }
+                },
+                'cache': self._cache_stats,
+                'attempts': self._attempts
             },
             'variables': self._parse_variables(job_description.variable_definition(), variables)
         }
 
-    def execute(self):
+    def execute(self, max_workers: int = None, checkpoint: bool = False, resume: bool = False):
+        """
+        Executes the steps of the job.
+
+        Args:
+            max_workers (int): if given (or the job defines '_parallel'), runs the steps which don't reference each
+                other's results concurrently with a thread pool, 'True' means the default pool size.
+            checkpoint (bool): saves the result of each succeeded step, the checkpoint is removed once the job succeeded.
+                Each execution has its own checkpoint.
+            resume (bool): restores the results saved by the latest failed execution, and skips these steps, the
+                execution takes over its checkpoint.
+        """
         step_names = [key for key in self._job.keys() if not key.startswith('_')]
+        self._step_names = step_names
+        parallel = max_workers if max_workers is not None else self._job.get('_parallel')
+        if checkpoint or resume:
+            self._checkpoint = open_run(self._checkpoint_key(), resume)
+        self._liveness = self._analyze_liveness(step_names)
+        completed = self._restore_checkpoint(len(step_names)) if resume else set()
+        for index in sorted(completed):
+            self._release_results(index)
+        if self._checkpoint and not completed:
+            self._save_variables()
+        start = time.perf_counter()
+        status = 'failure'
+        with span(self._tracer, f'{self._repository_name}:{self._job_name}', 'job'), self._admit_job():
+            try:
+                if parallel:
+                    self._execute_parallel(step_names, None if parallel is True else parallel, completed)
+                else:
+                    for index in range(len(step_names)):
+                        if index + 1 not in completed:
+                            self._complete_step(index + 1, self._exec_step_named(step_names[index], index + 1))
+                self._exec_handler('success')
+                status = 'success'
+                if self._checkpoint:
+                    self._checkpoint.clear()
+            except StepError as e:
+                self._exec_handler('error', {'error': e}, e.step_name)
+                raise
+            finally:
+                labels = {'repository': self._repository_name, 'job': self._job_name}
+                REGISTRY.observe('jobchain_job_duration_seconds', 'The duration of the jobs.',
+                                 {**labels, 'status': status}, time.perf_counter() - start)
+                REGISTRY.inc('jobchain_resolutions', 'The expressions evaluated by the jobs.', labels,
+                             next(self._resolutions))
+                if self._step_cache:
+                    logger.info(f"Step cache: {self._cache_stats['hits']} hits, {self._cache_stats['misses']} misses")
+                    self._step_cache.evict(STEP_CACHE_MAX_SIZE, STEP_CACHE_MAX_AGE)
+                if self._checkpoint:
+                    close_run(self._checkpoint)
+
+    @contextlib.contextmanager
+    def _admit_job(self):
+        """
+        Holds the '_resources' of the job in the machine-wide slots, the steps of the job share them. Otherwise the
+        steps are admitted by the machine-wide slots. The slots are created before any step runs.
+        """
+        resources = self._job.get('_resources')
+        if not resources:
+            self._slots = MachineSlots()
+            yield
+            return
+        need = parse_resources(self._resolve_context(resources))
+        with MachineSlots().acquire(need, f'{self._repository_name}:{self._job_name}'):
+            self._slots = LocalSlots(need)
+            yield
+
+    def _execute_parallel(self, step_names: list, max_workers: int = None, completed: set = None):
+        dependencies = {}
+        for index, step_name in enumerate(step_names, 1):
+            if _resolves_itself(re.match(JobDescription.STEP_NAME_PATTERN, step_name).group(1)):
+                # the references of the step can't be found statically, it waits for all the previous steps.
+                dependencies[index] = set(range(1, index))
+            else:
+                dependencies[index] = {i for i in references(self._job[step_name]) if 0 < i < index}
+        completed = set(completed or ())
+        remaining = [index for index in dependencies.keys() if index not in completed]
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while remaining or running:
+                if error is None:
+                    for index in [i for i in remaining if dependencies[i] <= completed]:
+                        remaining.remove(index)
+                        running[self._submit(pool, self._exec_step_named, step_names[index - 1], index)] = index
+                if not running:
+                    break
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    try:
+                        self._complete_step(index, future.result())
+                        completed.add(index)
+                    except StepError as e:
+                        # stop scheduling, but let the running steps finish.
+                        error = error or e
+        if error:
+            raise error
+
+    def _complete_step(self, index: int, value):
+        if isinstance(value, collections.abc.Iterator) and not isinstance(value, Stream):
+            value = self._stream(index, value)
+        self._context[f'${index}'] = value
+        if self._checkpoint and not isinstance(value, Stream):
+            self._checkpoint.put(str(index), value)
+            self._save_variables()
+        self._release_results(index)
+        if f'${index}' in self._context and not isinstance(value, Stream) and exceeds(value, SPILL_THRESHOLD):
+            spilled = self._spill_store.spill(str(index), value)
+            if spilled:
+                logger.info(f'The result of step {index} is spilled to disk.')
+                self._context[f'${index}'] = spilled
+
+    def _save_variables(self):
+        # the variables resolved by the step are saved, so a resumed job sees the same values (e.g. a timestamp).
+        variables = self._context['variables'].resolved()
+        if len(variables) != self._saved_variables:
+            self._saved_variables = len(variables)
+            self._checkpoint.put('variables', variables)
+
+    def _analyze_liveness(self, step_names: list):
+        """
+        Finds the steps referencing the result of each step, and the results referenced by the event handlers.
+
+        Returns:
+            (consumers, pinned), or None if the references can't be found statically: the job defines
+            '_keep_results', or a step runner decorates its arguments or resolves the expressions with '__parser'.
+        """
+        if self._job.get('_keep_results'):
+            return None
+        if any(_resolves_itself(re.match(JobDescription.STEP_NAME_PATTERN, step_name).group(1))
+               for step_name in step_names):
+            return None
+        consumers = {index: set() for index in range(1, len(step_names) + 1)}
+        for index in range(1, len(step_names) + 1):
+            for referenced in references(self._job[step_names[index - 1]]):
+                if 0 < referenced < index:
+                    consumers[referenced].add(index)
+        pinned = set()
+        for event_name in ('success', 'error', 'retry'):
+            for step_name in [None] + step_names:
+                for handler in self._job_description.event_handlers(event_name, self._repository_name,
+                                                                     self._job_name, step_name):
+                    pinned |= references(handler.get('args', {}))
+        return consumers, pinned
+
+    def _release_results(self, index: int):
+        """
+        Releases the results which are no longer referenced by the remaining steps, after the step completed.
+        """
+        if self._liveness is None:
+            return
+        consumers, pinned = self._liveness
+        for referenced in [i for i, steps_left in consumers.items() if index in steps_left] + [index]:
+            consumers[referenced].discard(index)
+            if not consumers[referenced] and referenced not in pinned:
+                self._context.pop(f'${referenced}', None)
+
+    def _stream(self, index: int, iterator) -> Stream:
+        """
+        Wraps the iterator returned by the step, the following steps referencing '${index}' consume it lazily.
+        """
+        step_names = self._step_names
+        subscribers = sum(subscriptions(self._job[step_name], index) for step_name in step_names[index:])
+        buffer = (self._job[step_names[index - 1]] or {}).get('_buffer', DEFAULT_BUFFER)
+        return Stream(f'${index}', iterator, subscribers, buffer)
+
+    def _skip_streams(self, arguments: dict):
+        # the streams are no longer kept for the references of an ignored step.
+        for index in references(arguments):
+            value = self._context.get(f'${index}')
+            if isinstance(value, Stream):
+                value.skip(subscriptions(arguments, index))
+
+    def _checkpoint_key(self) -> str:
+        return digest(self._repository_name, self._job_name,
+                      json.dumps(thaw(self._job), sort_keys=True, default=repr),
+                      json.dumps(self._variables, sort_keys=True, default=repr))
+
+    def _restore_checkpoint(self, step_count: int) -> set:
+        variables = self._checkpoint.get('variables', _MISSING)
+        if variables is _MISSING:
+            logger.info('No checkpoint found, executing all steps.')
+            return set()
+        self._context['variables'].restore(variables)
+        completed = set()
+        for index in range(1, step_count + 1):
+            value = self._checkpoint.get(str(index), _MISSING)
+            if value is not _MISSING:
+                self._context[f'${index}'] = value
+                completed.add(index)
+        logger.info(f'Resumed from the checkpoint, skipping the completed steps {sorted(completed)}.')
+        return completed
+
+    @staticmethod
+    def _submit(pool: ThreadPoolExecutor, fn, *args):
+        # the context variables (e.g. the step the logs belong to) are propagated to the pool threads.
+        return pool.submit(contextvars.copy_context().run, fn, *args)
+
+    def _exec_step_named(self, step_name: str, index: int = None):
+        name, alias = re.match(JobDescription.STEP_NAME_PATTERN, step_name).groups()
+        return self._exec_step(name, alias, self._job[step_name], index)
+
+    def _exec_step(self, name, alias, arguments, index: int = None):
+        step_name = f"{name}{optional(alias).format('.{}')}"
+        # the logs of the step (including the ones of its threads) are tagged with the step.
+        token = step_context.set({'step': name, 'alias': alias, 'index': index})
         try:
-            for index in range(len(step_names)):
-                step_name = step_names[index]
-                step_name_matcher = re.match(JobDescription.STEP_NAME_PATTERN, step_name)
-                name, alias = step_name_matcher.groups()
-                step = self._job[step_name]
-                self._context[f'${index + 1}'] = self._exec_step(name, alias, step)
-            self._exec_handler('success')
-        except StepError as e:
-            self._exec_handler('error', {'error': e}, e.step_name)
-            raise
-
-    def _exec_step(self, name, alias, arguments):
-        logger.info(f"Running {name}{optional(alias).format('.{}')}")
+            logger.info('Running %s', step_name)
+            start = time.perf_counter()
+            labels = {'repository': self._repository_name, 'job': self._job_name, 'step': step_name}
+            with _closing_subscriptions() as opened, loading_scope():
+                try:
+                    with span(self._tracer, step_name, 'step'):
+                        try:
+                            ret_val = self._exec_step_traced(name, alias, arguments)
+                        except ParseError as e:
+                            # a variable is parsed on its first use, it fails the step using it.
+                            raise StepError(name, alias, str(e))
+                except StepError as e:
+                    REGISTRY.inc('jobchain_step_failures', 'The failures of the steps.',
+                                 {**labels, 'step': e.step_name})
+                    raise
+                finally:
+                    REGISTRY.observe('jobchain_step_duration_seconds', 'The duration of the steps.', labels,
+                                     time.perf_counter() - start)
+                if opened and isinstance(ret_val, collections.abc.Iterator):
+                    # the returned iterator may consume the subscriptions lazily (e.g. a generator mapping the items).
+                    ret_val, opened[:] = _closing(ret_val, list(opened)), []
+            logger.info('Finished %s in %.3fs', step_name, time.perf_counter() - start)
+            return ret_val
+        finally:
+            step_context.reset(token)
+
+    def _exec_step_traced(self, name, alias, arguments):
         step_runner = getattr(steps, name, None)
         if step_runner is None:
             logger.error(f"step runner [{name}] not found. {optional(alias).format('alis: {}')}")
             raise StepError(name, alias, 'Not found')
 
-        # Resolve the step parameters
         if hasattr(step_runner, 'decorate_arguments'):
-            arguments = step_runner.decorate_arguments(arguments)
-        step_params = {key: self._resolve_context(arguments[key]) for key in arguments.keys()}
+            # the job is memoized and frozen, decorate a mutable copy.
+            arguments = step_runner.decorate_arguments(thaw(arguments))
+
+        # Evaluate the condition first, the other parameters are not resolved for an ignored step.
+        with span(self._tracer, 'condition', 'condition'):
+            condition = self._resolve_context(arguments['_condition']) if '_condition' in arguments else True
+        if not condition:
+            logger.info('ignored %s%s', name, optional(alias).format('.{}'))
+            self._skip_streams({key: value for key, value in arguments.items() if key != '_condition'})
+            return None
+
+        if '_foreach' in arguments:
+            return self._exec_foreach(name, alias, step_runner, arguments)
+        return self._exec_item(name, alias, step_runner, arguments)
+
+    def _exec_foreach(self, name, alias, step_runner, arguments):
+        """
+        Executes the step once per item of '_foreach' on a thread pool, '_parallelism' is the max number of the
+        concurrent executions. The item and its index are accessible as '${.item}' and '${.index}' in the parameters.
+
+        Returns:
+            the results as the order of the items.
+        """
+        with span(self._tracer, 'foreach', 'resolve'):
+            items = self._resolve_context(arguments['_foreach'])
+        if isinstance(items, (str, bytes, collections.abc.Mapping)) or \
+                not isinstance(items, (collections.abc.Iterable, type(None))):
+            raise StepError(name, alias, f'invalid "_foreach" "{items}", it should be a list')
+        items = list(items or [])
+        parallelism = self._resolve_context(arguments.get('_parallelism'))
+        try:
+            parallelism = int(parallelism) if parallelism not in (None, '') else None
+            assert parallelism is None or parallelism > 0
+        except (TypeError, ValueError, AssertionError):
+            raise StepError(name, alias, f'invalid "_parallelism" "{parallelism}", it should be a positive integer')
+        item_arguments = {key: value for key, value in arguments.items() if key not in ('_foreach', '_parallelism')}
+        with ThreadPoolExecutor(max_workers=parallelism or None) as pool:
+            futures = [self._submit(pool, self._exec_item, name, alias, step_runner, item_arguments,
+                                    {'item': item, 'index': index})
+                       for index, item in enumerate(items)]
+            wait(futures)
+        errors = [(index, future.exception()) for index, future in enumerate(futures) if future.exception()]
+        if errors:
+            details = '; '.join(f'[{index}] {e.message if isinstance(e, StepError) else e}' for index, e in errors)
+            raise StepError(name, alias, f'{len(errors)} of {len(items)} items failed: {details}')
+        return [future.result() for future in futures]
+
+    def _exec_item(self, name, alias, step_runner, arguments, scoped_variables: dict=None):
+        # Resolve the step parameters
+        with span(self._tracer, 'resolve', 'resolve'):
+            step_params = {key: self._resolve_context(arguments[key], scoped_variables)
+                           for key in arguments.keys() if key != '_condition'}
 
         # Execute
         configs, params = JobExecutor._split(step_params)
-        if configs.get('_condition', True):
-            params['__context'] = dict()
-            params['__parser'] = self._resolve_context
-            parameter_names = inspect.signature(step_runner.run).parameters.keys()
+        configs = JobExecutor._convert_configs(name, alias, configs)
+        cache_key = self._step_cache_key(name, step_runner, params) if configs.get('_cache') else None
+        if cache_key:
+            max_age = None if configs['_cache'] is True else configs['_cache']
+            ret_val = self._step_cache.get(cache_key, _MISSING, max_age)
+            self._count_cache(ret_val is not _MISSING)
+            if ret_val is not _MISSING:
+                logger.info('cache hit %s%s', name, optional(alias).format('.{}'))
+                return ret_val
+        params['__context'] = dict()
+        params['__parser'] = self._resolve_context
+        parameter_names = _parameter_names(step_runner.run)
+        kwargs = {arg: value for arg, value in params.items() if arg in parameter_names}
+        if configs.get('_retry') or configs.get('_hedge_after'):
+            ret_val = self._run_attempts(name, alias, step_runner, kwargs, configs, scoped_variables)
+        else:
             try:
-                return step_runner.run(**{arg: value for arg, value in params.items() if arg in parameter_names})
+                with span(self._tracer, 'run', 'run'):
+                    ret_val = self._run_step(name, step_runner, kwargs, configs.get('_timeout'),
+                                             configs.get('_concurrency'), configs.get('_resources'))
             except Exception as e:
                 raise StepError(name, alias, str(e))
-        else:
-            logger.info(f"ignored {name}{optional(alias).format('.{}')}")
+        if cache_key:
+            self._step_cache.put(cache_key, ret_val)
+        return ret_val
+
+    def _run_attempts(self, name, alias, step_runner, kwargs: dict, configs: dict, scoped_variables: dict=None):
+        """
+        Runs the step at most '_retry' + 1 times until it succeeded, waits a random time up to '_backoff' * 2^(n-1)
+        seconds (1 by default) before the retry n. If an attempt is not finished in '_hedge_after' seconds, a second
+        one is started concurrently, the first succeeded is taken. The '_on_retry' handlers are executed before each
+        retry, the attempts are saved into '${0.attempts}' by the step name.
+        """
+        step_name = f"{name}{optional(alias).format('.{}')}"
+        retries = configs.get('_retry') or 0
+        backoff = configs.get('_backoff', 1)
+        hedge_after = configs.get('_hedge_after')
+
+        def attempt_once():
+            return self._run_step(name, step_runner, kwargs, configs.get('_timeout'), configs.get('_concurrency'),
+                                  configs.get('_resources'))
+
+        attempts = self._attempts.setdefault(step_name, [])
+        for attempt in range(1, retries + 2):
+            start = time.perf_counter()
+            try:
+                with span(self._tracer, 'run', 'run', attempt=attempt):
+                    ret_val, hedged = hedge(attempt_once, hedge_after) if hedge_after else (attempt_once(), False)
+                attempts.append({'attempt': attempt, 'latency': time.perf_counter() - start, 'error': None,
+                                 'hedged': hedged})
+                return ret_val
+            except Exception as e:
+                attempts.append({'attempt': attempt, 'latency': time.perf_counter() - start, 'error': str(e),
+                                 'hedged': False})
+                if attempt > retries:
+                    raise StepError(name, alias, str(e), list(attempts))
+                delay = random.uniform(0, backoff * 2 ** (attempt - 1))
+                logger.warning('%s failed (attempt %d of %d), retrying in %.2fs: %s',
+                               step_name, attempt, retries + 1, delay, e)
+                self._exec_handler('retry', {**(scoped_variables or {}), 'error': e, 'attempt': attempt,
+                                             'delay': delay}, step_name)
+                time.sleep(delay)
+
+    def _run_step(self, name: str, step_runner, kwargs: dict, timeout: float = None, concurrency: int = None,
+                  resources: dict = None):
+        """
+        Calls the step runner, a coroutine 'run' is driven on the shared event loop.
+
+        Args:
+            timeout (float): '_timeout', the max seconds the step can take
+            concurrency (int): '_concurrency', the max number of the concurrent executions of the step runner
+            resources (dict): '_resources', the step waits until they are available, in the resources of the job if
+                the job declares them, otherwise in the machine-wide slots
+        """
+        semaphore = self._semaphore(name, concurrency) if concurrency else None
+        if semaphore:
+            semaphore.acquire()
+        try:
+            if not resources:
+                return call(step_runner.run, kwargs, timeout)
+            with self._slots.acquire(parse_resources(resources), name):
+                return call(step_runner.run, kwargs, timeout)
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    def _semaphore(self, name: str, concurrency: int) -> threading.Semaphore:
+        with self._semaphores_lock:
+            if name not in self._semaphores:
+                self._semaphores[name] = threading.BoundedSemaphore(concurrency)
+            return self._semaphores[name]
+
+    def _step_cache_key(self, name: str, step_runner, params: dict):
+        source_digest = _source_digest(step_runner)
+        if source_digest is None:
+            logger.warning(f'The source of step runner [{name}] is not available, the result will not be cached.')
+            return None
+        try:
+            # the reprs of the other objects may contain the memory addresses, they can't be the keys.
+            params_json = json.dumps(params, sort_keys=True)
+        except (TypeError, ValueError):
+            logger.warning(f'The parameters of step [{name}] are not JSON values, the result will not be cached.')
+            return None
+        if self._step_cache is None:
+            self._step_cache = DiskCache('step')
+        return digest(name, source_digest, params_json)
+
+    def _count_cache(self, hit: bool):
+        with self._cache_stats_lock:
+            self._cache_stats['hits' if hit else 'misses'] += 1
 
     def _exec_handler(self, event_name: str, scoped_variables: dict=None, step_name: str=None):
         error_handlers = self._job_description.event_handlers(event_name, self._repository_name, self._job_name, step_name)
+        with _closing_subscriptions(), loading_scope():
+            self._exec_handlers(event_name, error_handlers, scoped_variables)
+
+    def _exec_handlers(self, event_name: str, error_handlers: tuple, scoped_variables: dict=None):
         for handler in error_handlers:
             event_handler = getattr(events, handler['name'], None)
             if event_handler is None:
                 raise NotImplementedError(f'Event handler \'{handler.name}\' not implemented yet.')
-            parsed_args = {name: self._resolve_context(value, scoped_variables) for name, value in handler.get('args', {}).items()}
-            # TODO Should I pass the event object into the handler ?
-            if event_handler.run(**parsed_args):
+            start = time.perf_counter()
+            with span(self._tracer, f"on_{event_name} {handler['name']}", 'handler'):
+                parsed_args = {name: self._resolve_context(value, scoped_variables) for name, value in handler.get('args', {}).items()}
+                # TODO Should I pass the event object into the handler ?
+                handled = call(event_handler.run, parsed_args)
+            REGISTRY.observe('jobchain_handler_duration_seconds', 'The duration of the event handlers.',
+                             {'event': event_name, 'handler': handler['name']}, time.perf_counter() - start)
+            if handled:
                 break
 
     def _resolve_context(self, value, scoped_variables: dict=None):
         if type(value) == str:
             return self._convert_variable(value, scoped_variables)
-        elif type(value) == list:
+        elif isinstance(value, (list, tuple)):
             return [self._resolve_context(item, scoped_variables) for item in value]
-        elif type(value) == dict:
+        elif isinstance(value, (dict, MappingProxyType)):
             return {k: self._resolve_context(v, scoped_variables) for k, v in value.items()}
         return value
 
-    def _internal_variable_matched(self, m, to_str: bool = True, scoped_variables: dict=None):
-        path, idx = m.groups()
-        path_parts = [x.strip('[]') for x in re.findall(INTERNAL_VARIABLE_PART, f'${path}')]
+    def _internal_value(self, accessor: Callable[[Mapping], Any], scoped_variables: dict=None):
         context_value = self._context
         if scoped_variables:
-            context_value = {**context_value, '$': scoped_variables}
-        v = get_nested(context_value, path_parts)
-        return str(v) if to_str else v
+            # overlay the scoped variables without copying the context.
+            context_value = ChainMap({'$': scoped_variables}, context_value)
+        value = accessor(context_value)
+        if isinstance(value, Stream):
+            value = value.subscribe()
+            opened = _subscriptions.get()
+            if opened is not None:
+                opened.append(value)
+        return value
+
+    def _variable_value(self, variable_name: str):
+        return self._context.get('variables', {}).get(variable_name)
 
     def _variable_matched(self, m, to_str: bool = True, variables: dict=None):
         variable_name, = m.groups()
         if variables is None:
-            v = self._context.get('variables', {}).get(variable_name)
+            v = self._variable_value(variable_name)
         else:
             v = variables.get(variable_name)
         return str(v) if to_str else v
 
     def _func_matched(self, m, to_str: bool = True, argument_resolver: Callable[[str], list] = None):
         func_name, args_str = m.groups()
-        parameters = argument_resolver(args_str) if argument_resolver else self._default_argument_resolver(args_str)
+        ret_val = self._function_value(func_name, args_str, argument_resolver=argument_resolver)
+        return str(ret_val) if to_str else ret_val
 
-        if func_name == 'eval':
-            ret_val = parameters[0] if len(parameters) == 1 else parameters
+    def _function_value(self, func_name: str, args_str: str, scoped_variables: dict=None,
+                        argument_resolver: Callable[[str], list] = None):
+        if argument_resolver:
+            parameters = argument_resolver(args_str)
         else:
-            func = getattr(functions, func_name, None)
-            if not func:
-                raise NotImplementedError(f'function "{func_name}" not supported yet.')
-            ret_val = func.run(*parameters)
-        return str(ret_val) if to_str else ret_val
+            parameters = self._default_argument_resolver(
+                args_str, variable_converter=lambda v: self._convert_variable(v, scoped_variables))
+
+        if func_name == 'eval':
+            return parameters[0] if len(parameters) == 1 else parameters
+        func = getattr(functions, func_name, None)
+        if not func:
+            raise NotImplementedError(f'function "{func_name}" not supported yet.')
+        return func.run(*parameters)
 
     def _convert_variable(self, value, scoped_variables: dict=None):
-        matcher = re.fullmatch(INTERNAL_VARIABLE_PATTERN, value)
-        if matcher:
-            return self._internal_variable_matched(matcher, False, scoped_variables)
-        matcher = re.fullmatch(VARIABLE_PATTERN, value)
-        if matcher:
-            return self._variable_matched(matcher, False)
-        matcher = re.fullmatch(FUNC_PATTERN, value)
-        if matcher:
-            return self._func_matched(matcher, False)
-        # treat as a string replace holder
-        ret_value = re.sub(FUNC_PATTERN, self._func_matched, value)
-        ret_value = re.sub(INTERNAL_VARIABLE_PATTERN, lambda m: self._internal_variable_matched(m, True, scoped_variables), ret_value)
-        ret_value = re.sub(VARIABLE_PATTERN, self._variable_matched, ret_value)
-        return ret_value
+        next(self._resolutions)
+        return compile_expression(value).evaluate(self, scoped_variables)
 
     def _default_argument_resolver(self, args_str: str,
                                    variable_pattern: str=ALL_VARIABLE_PATTERN,
                                    variable_converter: Callable[[str], Any]=None):
         if not args_str:
             return []
-        variables = re.findall(variable_pattern, args_str)
-        if not variables:
-            return eval(f'[{args_str}]')
+        names, resolver = compile_arguments(args_str, variable_pattern)
 
         if not variable_converter:
             variable_converter = self._convert_variable
-        mapped_variables = {variables[i]: f'_var_{i}' for i in range(len(variables))}
-        names = mapped_variables.keys()
-        generated_args = ", ".join([mapped_variables[name] for name in names])
-        generated_body = re.sub(variable_pattern, lambda vm: mapped_variables[vm.group(1)], args_str)
-        generated_lambda = f'lambda {generated_args}: [{generated_body}]'
-        logger.info(f'Resolving the argument expression: {args_str}\n\tGenerated argument resolver: {generated_lambda}')
-        return eval(generated_lambda)(*[variable_converter(v) for v in names])
+        return resolver(*[variable_converter(v) for v in names])
 
-    def _parse_variables(self, variable_definition: dict, variables: dict):
+    def _parse_variables(self, variable_definition: dict, variables: dict) -> Variables:
+        """
+        Returns the variables of the job, the defined ones are parsed lazily on their first access.
+        """
 
         def func_matcher_resolver(m, value, to_str=False):
             return self._func_matched(m, to_str=to_str, argument_resolver=lambda args: argument_resolver(args, value))
@@ -172,23 +612,41 @@ class JobExecutor:
             if type(value) == str:
                 matcher = re.fullmatch(VARIABLE_PATTERN, value)
                 if matcher:
-                    return self._variable_matched(matcher, False, variables)
+                    # the value can reference the given variables and the other defined ones.
+                    return self._variable_matched(matcher, False, parsed)
             return value
 
-        def parse(name, parser: str=None, value=None):
+        def parse(name, definition: dict):
+            parser, value = definition.get('parser'), definition.get('value')
             try:
-                v = variables.get(name, value_resolver(value))
+                v = parsed.given[name] if name in parsed.given else value_resolver(value)
                 if parser is None:
                     return v
                 matcher = re.fullmatch(FUNC_PATTERN, parser)
                 if matcher:
                     return func_matcher_resolver(matcher, v)
                 return re.sub(FUNC_PATTERN, lambda m: func_matcher_resolver(m, v, True), parser)
+            except ParseError:
+                raise
             except Exception as e:
                 raise ParseError(name, parser, value, str(e))
 
-        return {**variables, **{name: parse(name, **definition)
-                                for name, definition in variable_definition.items() if not name.startswith('_')}}
+        parsed = Variables(variable_definition, variables, parse)
+        return parsed
+
+    @staticmethod
+    def _convert_configs(name, alias, configs: dict) -> dict:
+        """
+        Converts the numeric configuration keys, e.g. '_timeout: ${timeout}' is resolved as a string.
+        """
+        for key, convert in _NUMERIC_CONFIGS.items():
+            value = configs.get(key)
+            if value not in (None, ''):
+                try:
+                    configs[key] = convert(value)
+                except (TypeError, ValueError):
+                    raise StepError(name, alias, f'invalid "{key}" "{value}", it should be a number')
+        return configs
 
     @staticmethod
     def _split(full_params: dict):
@@ -200,3 +658,45 @@ class JobExecutor:
             else:
                 params[key] = value
         return configs, params
+
+
+# the function arguments could reference the executor when they were evaluated in this module.
+EVAL_GLOBALS['JobExecutor'] = JobExecutor
+
+
+def _resolves_itself(name: str) -> bool:
+    """
+    Returns True if the step runner resolves the expressions itself ('decorate_arguments' or the '__parser' parameter),
+    or it's not found. A runner not imported yet is checked by its source, so the steps which never run are not imported.
+    """
+    step_runner = vars(steps).get(name)
+    if step_runner is None:
+        source = steps._registry.source(name)
+        return source is None or 'decorate_arguments' in source or '__parser' in source
+    return hasattr(step_runner, 'decorate_arguments') or '__parser' in _parameter_names(step_runner.run)
+
+
+@contextlib.contextmanager
+def _closing_subscriptions():
+    """
+    Collects the stream subscriptions opened in the context, closes them on exit.
+    """
+    opened = []
+    token = _subscriptions.set(opened)
+    try:
+        yield opened
+    finally:
+        _subscriptions.reset(token)
+        for subscription in opened:
+            subscription.close()
+
+
+def _closing(iterator, subscriptions: list):
+    """
+    Yields the items of the iterator, closes the subscriptions once it's exhausted or closed.
+    """
+    try:
+        yield from iterator
+    finally:
+        for subscription in subscriptions:
+            subscription.close()
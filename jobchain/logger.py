@@ -1,4 +1,13 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging.config
+import logging.handlers
+import os
+import queue
+import re
+import time
 
 config = {
     'disable_existing_loggers': False,
@@ -28,6 +37,151 @@ config = {
     },
 }
 
+# the step being executed in the current thread (or task), {'step', 'alias', 'index'}.
+step_context = contextvars.ContextVar('jobchain_step', default=None)
+
+
+class _ContextFilter(logging.Filter):
+
+    """
+    Attaches the step of the current context to the record, it must run in the logging thread.
+    """
+    def filter(self, record):
+        step = step_context.get()
+        record.step = step and step['step']
+        record.alias = step and step['alias']
+        record.index = step and step['index']
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+
+    """
+    Puts a copy of the record into the queue with the message merged with its arguments, as the stdlib QueueHandler
+    does, the arguments may be modified (or gone) by the time the listener thread handles it. The lines are formatted
+    by the handlers behind the queue.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            # the traceback can't outlive the frames, render it now.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+
+    """
+    Formats the record as a JSON line, with the step name, alias and index ($N) if it's logged by a step.
+    """
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+            'step': getattr(record, 'step', None),
+            'alias': getattr(record, 'alias', None),
+            'index': getattr(record, 'index', None)
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class StepFileHandler(logging.Handler):
+
+    """
+    Writes the records of each step into its own file '<index>-<step>[.<alias>].log' under the directory, the records
+    not logged by a step go to 'job.log'.
+    """
+    def __init__(self, directory: str):
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter(config['formatters']['short']['format']))
+        self.directory = directory
+        self._files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def emit(self, record):
+        # noinspection PyBroadException
+        try:
+            step = getattr(record, 'step', None)
+            name = 'job' if step is None else \
+                f"{record.index or 0}-{step}{'.' + record.alias if record.alias else ''}"
+            f = self._files.get(name)
+            if f is None:
+                f = self._files[name] = open(os.path.join(self.directory, re.sub(r'[^\w.-]', '_', name) + '.log'),
+                                             'a', encoding='utf-8')
+            f.write(self.format(record) + '\n')
+            f.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        logging.Handler.close(self)
+
 
 logging.config.dictConfig(config)
 logger = logging.getLogger('jenkins')
+
+# the handlers configured above run behind a queue, so a log call never blocks on the output.
+_handlers = list(logger.handlers)
+_queue_handler = _QueueHandler(queue.SimpleQueue())
+_queue_handler.addFilter(_ContextFilter())
+for _logger in (logger, logging.getLogger()):
+    for _handler in _handlers:
+        _logger.removeHandler(_handler)
+    _logger.addHandler(_queue_handler)
+_listener = None
+
+
+def add_handler(handler: logging.Handler):
+    """
+    Adds a handler behind the queue, e.g. StepFileHandler or a StreamHandler with JsonFormatter.
+    """
+    shutdown()
+    _handlers.append(handler)
+    _start()
+
+
+def flush():
+    """
+    Waits until the queued records are handled.
+    """
+    shutdown()
+    _start()
+
+
+def shutdown():
+    """
+    Handles the queued records and stops the listener, e.g. before a worker process exits without the atexit hooks.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _start():
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_in_child():
+    # the listener thread doesn't survive the fork (e.g. the batch worker processes).
+    _queue_handler.queue = queue.SimpleQueue()
+    _start()
+
+
+_start()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_in_child)
+atexit.register(shutdown)
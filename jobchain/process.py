@@ -0,0 +1,219 @@
+import atexit
+import collections
+import contextvars
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .exception import ProcessError
+from .logger import logger
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+DEFAULT_TAIL = 50
+KILL_GRACE = 5
+
+_LIMITS = {
+    'cpu': 'RLIMIT_CPU',
+    'memory': 'RLIMIT_AS',
+    'files': 'RLIMIT_NOFILE',
+    'file_size': 'RLIMIT_FSIZE',
+}
+
+# sets the resource limits and replaces itself with the command, preexec_fn is not safe with the threads.
+_LIMITER = 'import json, os, resource, sys\n' \
+           'for limit, value in json.loads(sys.argv[1]):\n' \
+           '    resource.setrlimit(limit, (value, value))\n' \
+           'os.execvp(sys.argv[2], sys.argv[2:])\n'
+
+# the running commands, their process groups are killed if this process exits.
+_running = set()
+_running_lock = threading.Lock()
+
+
+class ProcessResult:
+
+    """
+    The result of a command.
+
+    Attributes:
+        command (str): the command line
+        returncode (int): exit status, negative if killed by a signal
+        stdout (str): the last lines of the stdout
+        stderr (str): the last lines of the stderr
+        duration (float): the elapsed seconds
+        timed_out (bool): True if the command was killed for the timeout
+    """
+    def __init__(self, command: str, returncode: int, stdout: str, stderr: str, duration: float, timed_out: bool):
+        self.command = command
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.timed_out = timed_out
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+    def check(self):
+        """
+        Raises ProcessError if the command failed, otherwise returns self.
+        """
+        if not self.succeeded:
+            raise ProcessError(self.command, self.returncode, self.stderr or self.stdout, self.timed_out)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            'command': self.command,
+            'returncode': self.returncode,
+            'stdout': self.stdout,
+            'stderr': self.stderr,
+            'duration': self.duration,
+            'timed_out': self.timed_out
+        }
+
+
+def run(command, cwd: str = None, env: dict = None, timeout: float = None, limits: dict = None,
+        tail: int = DEFAULT_TAIL, name: str = None) -> ProcessResult:
+    """
+    Runs the command, its stdout and stderr are logged line by line while it's running.
+
+    Args:
+        command: a string runs by the shell, or a list of the program and its arguments
+        cwd (str): the working directory
+        env (dict): the environment variables, added to the ones of the current process
+        timeout (float): the max seconds, the command (and its child processes) is killed once exceeded
+        limits (dict): the resource limits of the process (POSIX only), the keys are 'cpu' (seconds), 'memory'
+            (bytes of the address space), 'files' (the number of the open files) and 'file_size' (bytes)
+        tail (int): the number of the last lines of the stdout and the stderr kept in the result
+        name (str): the prefix of the logs, the program name by default
+    """
+    shell = isinstance(command, str)
+    command_line = command if shell else ' '.join(shlex.quote(str(arg)) for arg in command)
+    if name is None:
+        name = os.path.basename(_program(command) if shell else str(command[0]))
+    args = command
+    if limits:
+        args = [sys.executable, '-S', '-c', _LIMITER, json.dumps(_limit_settings(limits))] + \
+               (['/bin/sh', '-c', command] if shell else [str(arg) for arg in command])
+        shell = False
+    start = time.time()
+    process = subprocess.Popen(args, shell=shell, cwd=cwd, env={**os.environ, **(env or {})} if env else None,
+                               stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               start_new_session=os.name == 'posix')
+    with _running_lock:
+        _running.add(process)
+    stdout = collections.deque(maxlen=tail)
+    stderr = collections.deque(maxlen=tail)
+    # the context variables (e.g. the step the logs belong to) are propagated to the reader threads.
+    readers = [threading.Thread(target=contextvars.copy_context().run, args=(_pump, pipe, lines, prefix), daemon=True)
+               for pipe, lines, prefix in ((process.stdout, stdout, f'[{name}] '),
+                                           (process.stderr, stderr, f'[{name} stderr] '))]
+    for reader in readers:
+        reader.start()
+    timed_out = False
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        logger.error(f'The command \'{command_line}\' timed out after {timeout} seconds, killing it.')
+        _kill(process)
+    except BaseException:
+        _kill(process)
+        raise
+    finally:
+        with _running_lock:
+            _running.discard(process)
+        # a child process left in background may hold the pipes, don't wait for it.
+        deadline = time.time() + KILL_GRACE
+        for reader in readers:
+            reader.join(max(deadline - time.time(), 0))
+    return ProcessResult(command_line, process.returncode, '\n'.join(stdout), '\n'.join(stderr),
+                         time.time() - start, timed_out)
+
+
+def run_all(commands: list, parallelism: int = None, **kwargs) -> list:
+    """
+    Runs the commands concurrently, at most parallelism processes at a time, the other arguments are passed to run.
+
+    Returns:
+        the results as the order of the commands.
+    """
+    with ThreadPoolExecutor(max_workers=parallelism or None) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, run, command, **kwargs) for command in commands]
+        return [future.result() for future in futures]
+
+
+def _pump(pipe, lines: collections.deque, prefix: str):
+    with pipe:
+        for raw in iter(pipe.readline, b''):
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            lines.append(line)
+            logger.info(prefix + line)
+
+
+def _kill(process: subprocess.Popen):
+    """
+    Terminates the process group of the command, kills it if it's still alive after the grace period.
+    """
+    for sig, grace in ((signal.SIGTERM, KILL_GRACE), (getattr(signal, 'SIGKILL', signal.SIGTERM), None)):
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, sig)
+            else:
+                process.send_signal(sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+        try:
+            process.wait(grace)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def _program(command: str) -> str:
+    try:
+        return (shlex.split(command)[:1] or [''])[0]
+    except ValueError:
+        # e.g. the unbalanced quotes, which are still valid for the shell, e.g. in a heredoc.
+        return (command.split()[:1] or [''])[0]
+
+
+def _limit_settings(limits: dict) -> list:
+    assert resource, 'the resource limits are not supported on this platform'
+    unknown = limits.keys() - _LIMITS.keys()
+    assert not unknown, f'Not supported resource limits {sorted(unknown)}, the allowed are {sorted(_LIMITS)}'
+    # the address space of the launcher is limited last, the command replaces it right after.
+    return sorted([(getattr(resource, _LIMITS[key]), int(value)) for key, value in limits.items()],
+                  key=lambda setting: setting[0] == resource.RLIMIT_AS)
+
+
+def kill_running():
+    """
+    Kills the process groups of the running commands, e.g. the process is terminated, the commands MUST NOT outlive it
+    in their own sessions.
+    """
+    with _running_lock:
+        running = list(_running)
+    for process in running:
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+
+
+atexit.register(kill_running)
@@ -0,0 +1,19 @@
+from ..process import DEFAULT_TAIL, run_all
+
+
+def run(command, cwd=None, env=None, timeout=None, limits=None, parallelism=None, tail=DEFAULT_TAIL, check=True):
+    """
+    Runs the shell command, or the list of the shell commands concurrently (at most parallelism at a time), the output
+    is logged line by line.
+
+    Returns:
+        the result dict (command, returncode, stdout, stderr, duration, timed_out), or the list of them, stdout and
+        stderr are the last tail lines. If check, fails unless all the commands exited with 0.
+    """
+    commands = command if isinstance(command, list) else [command]
+    results = run_all(commands, parallelism, cwd=cwd, env=env, timeout=timeout, limits=limits, tail=tail)
+    if check:
+        for result in results:
+            result.check()
+    results = [result.to_dict() for result in results]
+    return results if isinstance(command, list) else results[0]
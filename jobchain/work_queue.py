@@ -0,0 +1,266 @@
+import abc
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from .daemon import DescriptionCache
+from .job_executor import JobExecutor
+from .logger import logger
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # python < 3.8
+    entry_points = None
+
+PENDING = 'pending'
+LEASED = 'leased'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# the finished tasks are pruned after a week by default.
+RETENTION = 7 * 24 * 3600
+# the max number of the task ids in a query.
+_IDS_PER_QUERY = 500
+
+
+class Task:
+
+    """
+    A job run in the work queue.
+
+    Attributes:
+        id (int): task id
+        run (dict): the job run, contains 'file', 'repository', 'job', and optional 'd', 'e', 'parallel'
+        attempts (int): the number of the leases, includes the current one
+    """
+    def __init__(self, task_id: int, run: dict, attempts: int):
+        self.id = task_id
+        self.run = run
+        self.attempts = attempts
+
+
+class WorkQueue(abc.ABC):
+
+    """
+    The interface of the work queue backends. The built-in one (SQLiteWorkQueue) is local, its workers run on the
+    machine of the database file, a backend of a queue server is needed to spread the jobs over several machines.
+
+    A worker leases a task for some seconds and keeps renewing the lease with heartbeats while running it, if the
+    worker is lost, the lease expires and the task is leased to another worker, until max_attempts is reached.
+    """
+    @abc.abstractmethod
+    def put(self, run: dict, max_attempts: int = 3) -> int:
+        pass
+
+    @abc.abstractmethod
+    def lease(self, worker: str, seconds: float):
+        """
+        Returns a Task, or None if no task available.
+        """
+
+    @abc.abstractmethod
+    def heartbeat(self, task_id: int, worker: str, seconds: float) -> bool:
+        """
+        Renews the lease, returns False if the task is no longer leased by the worker.
+        """
+
+    @abc.abstractmethod
+    def complete(self, task_id: int, worker: str, error: str = None):
+        pass
+
+    @abc.abstractmethod
+    def status(self, task_ids: list = None) -> list:
+        """
+        Returns the status dicts (id, run, status, worker, attempts, error) of the tasks.
+        """
+
+    @abc.abstractmethod
+    def unfinished(self) -> int:
+        """
+        Returns the number of the pending and leased tasks.
+        """
+
+    @abc.abstractmethod
+    def prune(self, seconds: float) -> int:
+        """
+        Removes the tasks finished more than seconds ago, returns the number of the removed ones.
+        """
+
+
+class SQLiteWorkQueue(WorkQueue):
+
+    """
+    The work queue backed by a SQLite database file, shared by the workers on the same machine. The file MUST NOT be on
+    NFS or the other network file systems, their file locks are unreliable, the database can be corrupted.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                               'id INTEGER PRIMARY KEY AUTOINCREMENT, run TEXT NOT NULL, status TEXT NOT NULL, '
+                               'worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, '
+                               'max_attempts INTEGER NOT NULL, error TEXT, finished_at REAL)')
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(tasks)')}
+            if 'finished_at' not in columns:
+                # created by an earlier version.
+                connection.execute('ALTER TABLE tasks ADD COLUMN finished_at REAL')
+            # the workers poll the tasks by the status.
+            connection.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id)')
+
+    def put(self, run: dict, max_attempts: int = 3) -> int:
+        with self._connect() as connection:
+            return connection.execute('INSERT INTO tasks (run, status, max_attempts) VALUES (?, ?, ?)',
+                                      (json.dumps(run), PENDING, max_attempts)).lastrowid
+
+    def lease(self, worker: str, seconds: float):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            # the tasks of the lost workers are failed once they reached the max attempts.
+            connection.execute('UPDATE tasks SET status = ?, error = ?, finished_at = ? '
+                               'WHERE status = ? AND lease_until < ? AND attempts >= max_attempts',
+                               (FAILED, 'the worker was lost', now, LEASED, now))
+            row = connection.execute('SELECT id, run, attempts FROM tasks '
+                                     'WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY id LIMIT 1',
+                                     (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            task_id, run, attempts = row
+            connection.execute('UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = ? WHERE id = ?',
+                               (LEASED, worker, now + seconds, attempts + 1, task_id))
+            return Task(task_id, json.loads(run), attempts + 1)
+
+    def heartbeat(self, task_id: int, worker: str, seconds: float) -> bool:
+        with self._connect() as connection:
+            return connection.execute('UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?',
+                                      (time.time() + seconds, task_id, worker, LEASED)).rowcount == 1
+
+    def complete(self, task_id: int, worker: str, error: str = None):
+        with self._connect() as connection:
+            connection.execute('UPDATE tasks SET status = ?, error = ?, finished_at = ? '
+                               'WHERE id = ? AND worker = ? AND status = ?',
+                               (FAILED if error else SUCCEEDED, error, time.time(), task_id, worker, LEASED))
+
+    def status(self, task_ids: list = None) -> list:
+        query = 'SELECT id, run, status, worker, attempts, error FROM tasks'
+        with self._connect() as connection:
+            if task_ids is None:
+                rows = connection.execute(query + ' ORDER BY id').fetchall()
+            else:
+                rows = []
+                for i in range(0, len(task_ids), _IDS_PER_QUERY):
+                    chunk = list(task_ids[i:i + _IDS_PER_QUERY])
+                    rows.extend(connection.execute(f'{query} WHERE id IN ({",".join("?" * len(chunk))})', chunk))
+                rows.sort()
+            return [{'id': task_id, 'run': json.loads(run), 'status': status, 'worker': worker,
+                     'attempts': attempts, 'error': error}
+                    for task_id, run, status, worker, attempts, error in rows]
+
+    def unfinished(self) -> int:
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)',
+                                      (PENDING, LEASED)).fetchone()[0]
+
+    def prune(self, seconds: float) -> int:
+        with self._connect() as connection:
+            return connection.execute('DELETE FROM tasks WHERE status IN (?, ?) AND finished_at < ?',
+                                      (SUCCEEDED, FAILED, time.time() - seconds)).rowcount
+
+    def _connect(self) -> '_Transaction':
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Transaction(connection)
+
+
+class _Transaction:
+
+    """
+    Commits (or rolls back) the explicit transaction and closes the connection.
+    """
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self._connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if self._connection.in_transaction:
+                self._connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._connection.close()
+
+
+BACKENDS = {'sqlite': SQLiteWorkQueue}
+
+
+def open_queue(url: str) -> WorkQueue:
+    """
+    Opens the work queue by the url, e.g. 'sqlite:///var/lib/jobchain/queue.db'. The other backends can be supplied by
+    the entry point group 'jobchain.queues', the entry point name is the url scheme.
+    """
+    scheme, _, location = url.partition('://')
+    assert location, f'invalid work queue "{url}", the format should be "scheme://location"'
+    backend = BACKENDS.get(scheme)
+    if backend is None and entry_points is not None:
+        eps = entry_points()
+        found = eps.select(group='jobchain.queues') if hasattr(eps, 'select') else eps.get('jobchain.queues', [])
+        backend = next((entry_point.load() for entry_point in found if entry_point.name == scheme), None)
+    assert backend, f'Not supported work queue "{scheme}"'
+    return backend(location)
+
+
+def work(queue: WorkQueue, lease_seconds: float = 60, poll_seconds: float = 5, drain: bool = False,
+         retention: float = RETENTION):
+    """
+    Runs the tasks of the queue, until the queue is empty if drain is True, otherwise forever. The tasks finished more
+    than retention seconds ago are pruned while the worker is idle.
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    descriptions = DescriptionCache()
+    logger.info(f'Worker {worker} started.')
+    while True:
+        task = queue.lease(worker, lease_seconds)
+        if task is None:
+            queue.prune(retention)
+            if drain and not queue.unfinished():
+                return
+            time.sleep(poll_seconds)
+            continue
+        run = task.run
+        logger.info(f'Running task {task.id} {run["repository"]}:{run["job"]} (attempt {task.attempts})')
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(queue, task.id, worker, lease_seconds, stop), daemon=True)
+        heartbeat.start()
+        error = None
+        # noinspection PyBroadException
+        try:
+            job_description = descriptions.get(run['file'], run.get('d'))
+            JobExecutor(job_description, run['repository'], run['job'], dict(run.get('e') or {})) \
+                .execute(run.get('parallel'))
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            logger.error(f'Task {task.id} failed: {error}')
+        finally:
+            stop.set()
+            heartbeat.join()
+        queue.complete(task.id, worker, error)
+
+
+def wait(queue: WorkQueue, task_ids: list, poll_seconds: float = 5) -> list:
+    """
+    Waits until the tasks are succeeded or failed, returns their status.
+    """
+    while True:
+        statuses = queue.status(task_ids)
+        if all(s['status'] in (SUCCEEDED, FAILED) for s in statuses):
+            return statuses
+        time.sleep(poll_seconds)
+
+
+def _heartbeat(queue: WorkQueue, task_id: int, worker: str, lease_seconds: float, stop: threading.Event):
+    while not stop.wait(lease_seconds / 3):
+        if not queue.heartbeat(task_id, worker, lease_seconds):
+            logger.warning(f'The lease of task {task_id} is lost, another worker may run it.')
+            return
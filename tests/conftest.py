@@ -0,0 +1,38 @@
+import os
+import tempfile
+import types
+
+import pytest
+
+# the caches and the resource slots of the tests MUST NOT touch the ones of the user, set before importing jobchain.
+_root = tempfile.mkdtemp(prefix='jobchain-tests-')
+os.environ['JOBCHAIN_CACHE_DIR'] = os.path.join(_root, 'cache')
+os.environ['JOBCHAIN_RESOURCES_FILE'] = os.path.join(_root, 'resources.json')
+
+
+@pytest.fixture
+def describe(tmp_path):
+    """
+    Writes the job description into a temporary file, returns the loaded JobDescription.
+    """
+    from jobchain.job_description import JobDescription
+
+    def load(text: str, name: str = 'jobs.yaml', **kwargs):
+        path = tmp_path / name
+        path.write_text(text, encoding='utf-8')
+        return JobDescription(str(path), **{'cache': False, **kwargs})
+
+    return load
+
+
+@pytest.fixture
+def step(monkeypatch):
+    """
+    Registers a step runner, e.g. step('echo', lambda value: value).
+    """
+    import jobchain.step as steps
+
+    def register(name: str, run, **attributes):
+        monkeypatch.setattr(steps, name, types.SimpleNamespace(run=run, **attributes), raising=False)
+
+    return register
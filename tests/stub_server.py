@@ -0,0 +1,49 @@
+import http.server
+import json
+import threading
+
+
+class StubServer:
+
+    """
+    A local HTTP server recording the requests (the JSON bodies posted to it), the responses are taken from the given
+    list in order, the last one is repeated. A response is (status, payload) or (status, payload, headers), a str payload
+    is sent as is, the others as JSON.
+    """
+    def __init__(self, responses=((200, {'errcode': 0}),)):
+        self.requests = []
+        self._responses = list(responses)
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append({'path': self.path, 'body': None})
+                self._respond()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.requests.append({'path': self.path, 'body': json.loads(body or b'null')})
+                self._respond()
+
+            def _respond(self):
+                status, payload, *headers = stub._responses.pop(0) if len(stub._responses) > 1 else stub._responses[0]
+                text = isinstance(payload, str)
+                data = (payload if text else json.dumps(payload)).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain' if text else 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/robot/send'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
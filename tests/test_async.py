@@ -0,0 +1,51 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from jobchain._async import call, hedge
+
+
+async def _sleep(seconds):
+    await asyncio.sleep(seconds)
+    return seconds
+
+
+def _raise_timeout():
+    raise socket.timeout('timed out')
+
+
+async def _raise_timeout_async():
+    raise socket.timeout('timed out')
+
+
+@pytest.mark.parametrize('timeout', [None, 5])
+@pytest.mark.parametrize('func', [_raise_timeout, _raise_timeout_async])
+def test_own_timeout_error_is_not_relabeled(func, timeout):
+    with pytest.raises(socket.timeout) as e:
+        call(func, {}, timeout)
+    assert str(e.value) == 'timed out'
+
+
+def test_coroutine():
+    assert call(_sleep, {'seconds': 0.01}) == 0.01
+
+
+@pytest.mark.parametrize('func', [lambda seconds: time.sleep(seconds), _sleep])
+def test_timeout(func):
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError, match='timed out after 0.1 seconds'):
+        call(func, {'seconds': 2}, 0.1)
+    assert time.perf_counter() - start < 1
+
+
+def test_hedge():
+    calls = []
+
+    def slow_first():
+        calls.append(None)
+        time.sleep(1 if len(calls) == 1 else 0)
+        return len(calls)
+
+    assert hedge(slow_first, 0.05) == (2, True)
@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+from .stub_server import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _jobchain(*args, **kwargs):
+    return subprocess.run([sys.executable, '-m', 'jobchain', *args], cwd=ROOT, timeout=60,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+
+def test_worker_logs_are_not_lost(tmp_path):
+    (tmp_path / 'jobs.yaml').write_text('''
+repositories:
+  app:
+    first:
+      shell:
+        command: for i in $(seq 500); do echo "${0.context.job}-$i"; done
+    second:
+      shell:
+        command: for i in $(seq 500); do echo "${0.context.job}-$i"; done
+''')
+    log = tmp_path / 'logs.jsonl'
+    result = _jobchain('-f', str(tmp_path / 'jobs.yaml'), '-b', 'app:*', '-w', '2', '--no-cache',
+                       '--log-json', str(log))
+    assert result.returncode == 0
+    messages = [json.loads(line)['message'] for line in log.read_text().splitlines()]
+    for job in ('first', 'second'):
+        assert sum(1 for message in messages if message.startswith(f'[for] {job}-')) == 500
+
+
+def test_worker_notifications_are_sent(tmp_path):
+    server = StubServer()
+    try:
+        (tmp_path / 'jobs.yaml').write_text('''
+repositories:
+  app:
+    _on_success:
+      name: dingding
+      args:
+        access_token: token
+        selector: '*'
+        messages:
+          '*':
+            msgtype: text
+            text:
+              content: ${0.context.job} succeeded
+    first:
+      shell:
+        command: 'true'
+    second:
+      shell:
+        command: 'true'
+''')
+        result = _jobchain('-f', str(tmp_path / 'jobs.yaml'), '-b', 'app:*', '-w', '2', '--no-cache',
+                           env={**os.environ, 'JOBCHAIN_DINGDING_URL': server.url})
+        assert result.returncode == 0
+        assert sorted(r['body']['text']['content'] for r in server.requests) == \
+            ['first succeeded', 'second succeeded']
+    finally:
+        server.close()
@@ -0,0 +1,56 @@
+import os
+import time
+
+from jobchain._cache import DiskCache
+from jobchain.job_executor import JobExecutor
+
+JOBS = '''
+repositories:
+  app:
+    build:
+      work:
+        _cache: true
+        value: ${value}
+'''
+
+
+def test_max_age_counts_from_creation(tmp_path):
+    cache = DiskCache('test', str(tmp_path))
+    cache.put('key', 'value')
+    # the hits renew the entry for the eviction, but not for max_age.
+    for _ in range(2):
+        time.sleep(0.1)
+        assert cache.get('key', max_age=0.25) == 'value'
+    time.sleep(0.1)
+    assert cache.get('key', 'expired', max_age=0.25) == 'expired'
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = DiskCache('test', str(tmp_path))
+    for key in ('a', 'b'):
+        cache.put(key, 'x' * 1000)
+    old = time.time() - 100
+    os.utime(os.path.join(cache.directory, 'a'), (old, old))
+    cache.evict(max_age=50)
+    assert cache.get('a') is None
+    assert cache.get('b') == 'x' * 1000
+
+
+def test_step_cache(describe, step):
+    calls = []
+    step('work', lambda value: calls.append(value) or len(calls))
+    description = describe(JOBS)
+    for _ in range(2):
+        JobExecutor(description, 'app', 'build', {'value': 'same'}).execute()
+    assert calls == ['same']
+
+
+def test_step_cache_skips_non_json_parameters(describe, step):
+    calls = []
+    step('work', lambda value: calls.append(value) or len(calls))
+    description = describe(JOBS)
+    for _ in range(2):
+        executor = JobExecutor(description, 'app', 'build')
+        executor._context['variables'] = {'value': object()}
+        executor.execute()
+    assert len(calls) == 2
@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+
+from jobchain import _checkpoint
+from jobchain._checkpoint import open_run, close_run
+from jobchain.exception import StepError
+from jobchain.job_executor import JobExecutor
+
+JOBS = '''
+repositories:
+  app:
+    build:
+      source:
+        value: a
+      fail:
+'''
+
+
+@pytest.fixture
+def job(describe, step, tmp_path, monkeypatch):
+    monkeypatch.setattr(_checkpoint, 'CACHE_DIR', str(tmp_path / 'cache'))
+    calls = []
+    failing = [True]
+
+    def fail():
+        if failing[0]:
+            raise RuntimeError('broken')
+
+    step('source', lambda value: calls.append(value) or value)
+    step('fail', fail)
+    return describe(JOBS), calls, failing
+
+
+def runs(tmp_path) -> list:
+    root = tmp_path / 'cache' / 'checkpoint'
+    return [run for job in root.iterdir() for run in job.iterdir()] if root.exists() else []
+
+
+def test_not_saved_by_default(job, tmp_path):
+    description, calls, failing = job
+    with pytest.raises(StepError):
+        JobExecutor(description, 'app', 'build').execute()
+    assert runs(tmp_path) == []
+
+
+def test_resume(job, tmp_path):
+    description, calls, failing = job
+    with pytest.raises(StepError):
+        JobExecutor(description, 'app', 'build').execute(checkpoint=True)
+    assert len(runs(tmp_path)) == 1
+    failing[0] = False
+    JobExecutor(description, 'app', 'build').execute(checkpoint=True, resume=True)
+    assert calls == ['a']
+    assert runs(tmp_path) == []
+
+
+def test_concurrent_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(_checkpoint, 'CACHE_DIR', str(tmp_path / 'cache'))
+    failed = open_run('job', False)
+    failed.put('1', 'saved')
+    close_run(failed)
+    # the running ones are not taken over, the failed one is resumed once.
+    running = open_run('job', False)
+    running.put('1', 'running')
+    first, second = open_run('job', True), open_run('job', True)
+    assert [first.get('1'), second.get('1'), running.get('1')] == ['saved', None, 'running']
+
+
+def test_evict_abandoned(tmp_path, monkeypatch):
+    monkeypatch.setattr(_checkpoint, 'CACHE_DIR', str(tmp_path / 'cache'))
+    abandoned, running = open_run('failed', False), open_run('running', False)
+    for checkpoint in (abandoned, running):
+        checkpoint.put('1', 'value')
+        old = time.time() - 100
+        os.utime(checkpoint.directory, (old, old))
+    close_run(abandoned)
+    _checkpoint.evict(50)
+    assert not os.path.exists(abandoned.directory) and os.path.exists(running.directory)
@@ -0,0 +1,108 @@
+import logging
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+import jobchain.step as steps
+from jobchain import daemon
+
+JOBS = '''
+repositories:
+  app:
+    build:
+      where:
+      fail:
+        _condition: ${fail}
+variable:
+  fail:
+    value: false
+'''
+
+
+@pytest.fixture
+def socket_path(tmp_path, describe, step):
+    describe(JOBS)
+
+    def where():
+        logging.getLogger('third_party').info('cwd %s, value %s', os.getcwd(), os.environ.get('JOBCHAIN_TEST_VALUE'))
+
+    def fail():
+        raise RuntimeError('broken')
+
+    step('where', where)
+    step('fail', fail)
+    path = str(tmp_path / 'd.sock')
+    threading.Thread(target=daemon.serve, args=(path,), daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    return path
+
+
+def _request(tmp_path, **variables):
+    return {'file': str(tmp_path / 'jobs.yaml'), 'repository': 'app', 'job': 'build', 'e': variables,
+            'no_cache': True}
+
+
+def test_runs_in_client_cwd_and_env(socket_path, tmp_path, monkeypatch, capsys):
+    workspace = tmp_path / 'workspace'
+    workspace.mkdir()
+    monkeypatch.chdir(workspace)
+    monkeypatch.setenv('JOBCHAIN_TEST_VALUE', 'from-client')
+    assert daemon.submit(socket_path, _request(tmp_path))
+    # the logs of the other loggers are streamed back too.
+    assert f'cwd {workspace}, value from-client' in capsys.readouterr().err
+    assert os.environ['JOBCHAIN_TEST_VALUE'] == 'from-client'
+
+
+def test_failure(socket_path, tmp_path, capsys):
+    assert not daemon.submit(socket_path, _request(tmp_path, fail='True'))
+    assert 'broken' in capsys.readouterr().err
+
+
+def test_socket_is_private(socket_path):
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+
+def test_refuses_to_remove_other_files(tmp_path):
+    path = tmp_path / 'not-a-socket'
+    path.write_text('data')
+    with pytest.raises(AssertionError):
+        daemon.serve(str(path))
+    assert path.read_text() == 'data'
+
+
+def test_refuses_a_running_daemon(socket_path):
+    with pytest.raises(AssertionError):
+        daemon.serve(socket_path)
+
+
+def test_step_imported_once(tmp_path, monkeypatch, describe):
+    # a step script counting its imports, the forked processes MUST inherit the one imported by the daemon.
+    scripts = tmp_path / 'scripts'
+    scripts.mkdir()
+    imports = tmp_path / 'imports'
+    (scripts / 'counted.py').write_text(f'with open({str(imports)!r}, "a") as f:\n    f.write("imported\\n")\n\n\n'
+                                        'def run():\n    pass\n')
+    monkeypatch.setattr(steps, '__path__', steps.__path__ + [str(scripts)])
+    monkeypatch.setattr(steps._registry, '_path', steps.__path__)
+    monkeypatch.setattr(steps._registry, '_modules', None)
+    describe('repositories:\n  app:\n    build:\n      counted:\n')
+    path = str(tmp_path / 'd.sock')
+    threading.Thread(target=daemon.serve, args=(path,), daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    try:
+        for _ in range(2):
+            assert daemon.submit(path, _request(tmp_path))
+        assert imports.read_text() == 'imported\n'
+    finally:
+        sys.modules.pop('jobchain.step.counted', None)
+        vars(steps).pop('counted', None)
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from jobchain.event import dingding
+from .stub_server import StubServer
+
+
+class _Recorder:
+
+    def __init__(self):
+        self.errors = []
+
+    def error(self, message, *args):
+        self.errors.append(message % args if args else message)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    servers = []
+
+    def start(*responses):
+        server = StubServer(*responses)
+        servers.append(server)
+        monkeypatch.setattr(dingding, 'URL', server.url)
+        monkeypatch.setattr(dingding, 'BACKOFF', 0.01)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def _text(content):
+    return {'msgtype': 'text', 'text': {'content': content}}
+
+
+def test_delivery(stub):
+    server = stub()
+    assert dingding.run('token', 'success', {'success': _text('first'), '*': _text('other')})
+    assert dingding.run('token', 'success', {'success': _text('second')})
+    assert not dingding.run('token', 'error', {'success': _text('ignored')})
+    assert dingding.flush(10)
+    # the messages of a burst are merged.
+    assert [r['body']['text']['content'] for r in server.requests] == ['first\nsecond']
+    assert server.requests[0]['path'] == '/robot/send?access_token=token'
+
+
+def test_retry(stub):
+    server = stub(((503, {}), (200, {'errcode': 130101, 'errmsg': 'too fast'}), (200, {'errcode': 0})))
+    dingding.run('token', '*', {'*': _text('retried')})
+    assert dingding.flush(10)
+    assert len(server.requests) == 3
+
+
+def test_failure_is_logged(stub, monkeypatch):
+    stub(((200, {'errcode': 310000, 'errmsg': 'keywords not in content'}),))
+    recorder = _Recorder()
+    monkeypatch.setattr(dingding, 'logger', recorder)
+    dingding.run('token', '*', {'*': _text('rejected')})
+    assert dingding.flush(10)
+    assert len(recorder.errors) == 1 and 'keywords not in content' in recorder.errors[0]
+
+
+def test_flush_on_exit(stub):
+    server = stub()
+    code = 'from jobchain.event import dingding; dingding.run("token", "*", {"*": {"msgtype": "text", ' \
+           '"text": {"content": "at exit"}}})'
+    subprocess.run([sys.executable, '-c', code], check=True, timeout=30,
+                   env={**os.environ, 'JOBCHAIN_DINGDING_URL': server.url},
+                   cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert [r['body']['text']['content'] for r in server.requests] == ['at exit']
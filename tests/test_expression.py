@@ -0,0 +1,21 @@
+import pytest
+
+from jobchain._expression import CACHE_SIZE, compile_arguments, compile_expression, references
+
+
+def test_references():
+    assert references({'a': '${1.x}', 'b': ['$eval(len(${2}));', 'plain']}) == {1, 2}
+
+
+def test_compiled_once_and_bounded():
+    assert compile_expression('${1.x}-${version}') is compile_expression('${1.x}-${version}')
+    assert compile_expression.cache_info().maxsize == CACHE_SIZE
+
+
+def test_arguments_namespace():
+    names, resolver = compile_arguments('len({}), {}.upper(), re.sub("b", "x", {})', '({})')
+    assert names == ('{}',) and resolver('abc') == [3, 'ABC', 'axc']
+    # the modules imported by the executor since are not visible.
+    for name in ('os', 'random', 'time', 'json'):
+        with pytest.raises(NameError):
+            compile_arguments(f'{name}', '({})')[1]()
@@ -0,0 +1,111 @@
+import threading
+import time
+import types
+
+import pytest
+
+import jobchain.event as events
+from jobchain.exception import StepError
+from jobchain.job_executor import JobExecutor
+
+
+@pytest.fixture
+def run_job(describe, step):
+    def run(steps: str, variables: dict = None, **runners):
+        for name, runner in runners.items():
+            step(name, runner)
+        description = describe('repositories:\n  app:\n    build:\n' + steps + '''
+variable:
+  hosts:
+    parser: $split({});
+    value: a b c
+''')
+        executor = JobExecutor(description, 'app', 'build', variables or {})
+        executor.execute()
+        return executor
+
+    return run
+
+
+def test_results_in_item_order(run_job):
+    results = []
+
+    def echo(value, index):
+        # the later items finish first.
+        time.sleep(0.01 * (5 - index))
+        return f'{index}:{value}'
+
+    run_job('''
+      echo:
+        _foreach: [a, b, c, d, e]
+        value: ${.item}
+        index: ${.index}
+      collect:
+        values: ${1}
+''', echo=echo, collect=lambda values: results.append(values))
+    assert results == [['0:a', '1:b', '2:c', '3:d', '4:e']]
+
+
+def test_variable_list(run_job):
+    results = []
+    run_job('''
+      echo:
+        _foreach: ${hosts}
+        value: host-${.item}
+      collect:
+        values: ${1}
+''', echo=lambda value: value, collect=lambda values: results.append(values))
+    assert results == [['host-a', 'host-b', 'host-c']]
+
+
+def test_parallelism(run_job):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            running.append(None)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    run_job('''
+      work:
+        _foreach: [1, 2, 3, 4, 5, 6]
+        _parallelism: ${limit}
+''', {'limit': '2'}, work=work)
+    assert len(peak) == 6 and max(peak) <= 2
+
+
+def test_failed_item(run_job):
+    def check(value):
+        if value % 2:
+            raise RuntimeError(f'odd {value}')
+        return value
+
+    with pytest.raises(StepError) as e:
+        run_job('''
+      check:
+        _foreach: [1, 2, 3]
+        value: ${.item}
+''', check=check)
+    assert e.value.message == '2 of 3 items failed: [0] odd 1; [2] odd 3'
+
+
+@pytest.mark.parametrize('attributes', ['_foreach: not a list', '_foreach: [1]\n        _parallelism: many',
+                                        '_foreach: [1]\n        _parallelism: 0'])
+def test_invalid_values(run_job, monkeypatch, attributes):
+    errors = []
+    monkeypatch.setattr(events, 'record', types.SimpleNamespace(run=lambda error: errors.append(error)), raising=False)
+    with pytest.raises(StepError):
+        run_job(f'''
+      echo:
+        {attributes}
+      _on_error:
+        name: record
+        args:
+          error: ${{.error.message}}
+''', echo=lambda: None)
+    assert len(errors) == 1 and 'invalid "_' in errors[0]
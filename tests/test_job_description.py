@@ -0,0 +1,105 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+JOBS = '''
+repositories:
+  app:
+    build:
+      checkout:
+      echo.done:
+        value: built ${version}
+template:
+  checkout:
+    branch: master
+variable:
+  version:
+    value: 1.0.0
+'''
+
+
+def test_import_without_runners():
+    # importing the command line MUST NOT import any step, function or event handler script.
+    code = 'import sys, jobchain.cli; print(sorted(m for m in sys.modules if m.startswith("jobchain.step.")))'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == '[]'
+
+
+def test_import_without_run_modes():
+    # the modules of the run modes are imported by the commands that need them, not by the startup of every command.
+    modules = ['asyncio', 'sqlite3', 'http.server', 'multiprocessing', 'jobchain.daemon', 'jobchain.batch',
+               'jobchain.work_queue', 'jobchain.job_executor']
+    code = f'import sys, jobchain.cli; print([m for m in {modules!r} if m in sys.modules])'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == '[]'
+
+
+def test_job_merges_templates(describe):
+    description = describe(JOBS)
+    assert description.job_names() == [('app', 'build')]
+    job = description.job('app', 'build')
+    assert list(job) == ['checkout', 'echo.done']
+    assert job['checkout'] == {'branch': 'master'}
+
+
+def test_job_read_only(describe):
+    # the merged job and the handlers are memoized and shared by the executors, they can't be modified.
+    description = describe(JOBS.replace('    build:\n', '''    build:
+      _on_error:
+        name: record
+        args:
+          tags: [a]
+'''))
+    job = description.job('app', 'build')
+    with pytest.raises(TypeError):
+        job['checkout']['branch'] = 'develop'
+    with pytest.raises(TypeError):
+        job['extra'] = {}
+    with pytest.raises(AttributeError):
+        job['echo.done'].pop('value')
+    handler, = description.event_handlers('error', 'app', 'build')
+    with pytest.raises(TypeError):
+        handler['args']['tags'][0] = 'b'
+    assert description.job('app', 'build')['checkout'] == {'branch': 'master'}
+    # the memos aren't pickled, the job is merged again.
+    assert pickle.loads(pickle.dumps(description)).job('app', 'build') == job
+
+
+def test_externals_override(describe):
+    description = describe(JOBS, externals={'template.checkout.branch': 'develop'})
+    assert description.job('app', 'build')['checkout'] == {'branch': 'develop'}
+
+
+def test_cached_description(describe):
+    first = describe(JOBS, cache=True)
+    second = describe(JOBS, cache=True)
+    assert second.job('app', 'build') == first.job('app', 'build')
+
+
+def test_cached_description_evicted(describe, monkeypatch):
+    import jobchain.job_description as job_description
+    from jobchain._cache import DiskCache
+
+    monkeypatch.setattr(job_description, 'DESCRIPTION_CACHE_MAX_SIZE', 0)
+    describe(JOBS, cache=True)
+    assert os.listdir(DiskCache('description').directory) == []
+
+
+def test_python_tags_not_loaded(describe):
+    with pytest.raises(yaml.YAMLError):
+        describe('repositories: !!python/object/apply:os.getcwd []')
+
+
+def test_self_include(describe):
+    with pytest.raises(AssertionError, match='circular include'):
+        describe('include: jobs.yaml\n' + JOBS)
+
+
+def test_include(describe, tmp_path):
+    (tmp_path / 'templates.yaml').write_text('template:\n  checkout:\n    branch: develop\n', encoding='utf-8')
+    description = describe('include: templates.yaml\nrepositories:\n  app:\n    build:\n      checkout:\n')
+    assert description.job('app', 'build')['checkout'] == {'branch': 'develop'}
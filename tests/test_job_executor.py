@@ -0,0 +1,203 @@
+import threading
+import time
+import types
+
+import pytest
+
+from jobchain.exception import StepError
+from jobchain._utils import thaw
+from jobchain.job_executor import JobExecutor
+
+JOBS = '''
+repositories:
+  app:
+    build:
+      source:
+        value: ${version}
+      echo:
+        value: built ${1}
+      fail:
+        _condition: ${fail}
+    parallel:
+      _parallel: 2
+      source:
+        value: a
+      source.b:
+        value: b
+      echo:
+        value: ${1}${2}
+variable:
+  version:
+    value: 1.0.0
+  fail:
+    value: false
+'''
+
+
+@pytest.fixture
+def jobs(describe, step):
+    step('source', lambda value: value)
+    step('echo', lambda value: value)
+
+    def fail():
+        raise RuntimeError('broken')
+
+    step('fail', fail)
+    return describe(JOBS)
+
+
+def test_execute(jobs):
+    executor = JobExecutor(jobs, 'app', 'build', {'version': '2.0.0'})
+    executor.execute()
+
+
+def test_step_error(jobs):
+    with pytest.raises(StepError) as e:
+        JobExecutor(jobs, 'app', 'build', {'fail': True}).execute()
+    assert e.value.step_name == 'fail'
+
+
+def test_parallel(jobs, step):
+    results = []
+    step('echo', lambda value: results.append(value))
+    JobExecutor(jobs, 'app', 'parallel').execute()
+    assert results == ['ab']
+
+
+def test_parallel_parser_step_waits(describe, step):
+    # the step resolves '${1}' itself, it can't run before the step 1 finished.
+    def slow(value):
+        time.sleep(0.1)
+        return value
+
+    step('slow', slow)
+    step('parse', lambda __parser: __parser('${1}'))
+    description = describe('''
+repositories:
+  app:
+    build:
+      _parallel: 2
+      _keep_results: true
+      slow:
+        value: done
+      parse:
+''')
+    executor = JobExecutor(description, 'app', 'build')
+    executor.execute()
+    assert executor._context['$2'] == 'done'
+
+
+def test_decorated_arguments_dont_modify_the_job(describe, step):
+    seen = []
+
+    def decorate(arguments):
+        arguments['value']['items'].append('decorated')
+        return arguments
+
+    step('source', lambda value: seen.append(list(value['items'])), decorate_arguments=decorate)
+    description = describe('''
+repositories:
+  app:
+    build:
+      source:
+        value:
+          items: [original]
+''')
+    for _ in range(2):
+        JobExecutor(description, 'app', 'build').execute()
+    assert seen == [['original', 'decorated']] * 2
+    assert thaw(description.job('app', 'build')['source']) == {'value': {'items': ['original']}}
+
+
+def test_variable_parse_error_fails_the_step(describe, step):
+    handled = []
+    step('source', lambda value: value)
+    description = describe('''
+repositories:
+  app:
+    build:
+      _on_error:
+        name: record
+        args:
+          step: ${.error.step_name}
+      source:
+        value: fine
+      source.broken:
+        value: ${broken}
+variable:
+  broken:
+    parser: $eval(1 / 0);
+''')
+    import jobchain.event as events
+    events.record = types.SimpleNamespace(run=lambda step: handled.append(step))
+    try:
+        with pytest.raises(StepError) as e:
+            JobExecutor(description, 'app', 'build').execute()
+    finally:
+        del events.record
+    assert e.value.step_name == 'source.broken'
+    assert 'broken' in e.value.message
+    assert handled == ['source.broken']
+
+
+def test_ignored_step_parameters_not_resolved(describe, step):
+    received = []
+    step('echo', lambda value: received.append(value))
+    description = describe('''
+repositories:
+  app:
+    build:
+      echo:
+        _condition: false
+        value: $eval(1 / 0);
+      echo.after:
+        value: ${1}
+''')
+    JobExecutor(description, 'app', 'build').execute()
+    assert received == [None]
+
+
+def test_concurrency(describe, step):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            running.append(None)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    step('work', work)
+    description = describe('''
+repositories:
+  app:
+    build:
+      _parallel: 4
+''' + ''.join(f'      work.{k}:\n        _concurrency: ${{limit}}\n' for k in range(4)))
+    JobExecutor(description, 'app', 'build', {'limit': '2'}).execute()
+    assert len(peak) == 4 and max(peak) <= 2
+
+
+def test_timeout_variable(describe, step):
+    step('slow', lambda: time.sleep(1))
+    description = describe('''
+repositories:
+  app:
+    build:
+      slow:
+        _timeout: ${timeout}
+''')
+    start = time.perf_counter()
+    with pytest.raises(StepError):
+        JobExecutor(description, 'app', 'build', {'timeout': '0.1'}).execute()
+    assert time.perf_counter() - start < 0.9
+
+
+def test_invalid_concurrency(describe, step):
+    step('work', lambda: None)
+    description = describe('repositories:\n  app:\n    build:\n      work:\n        _concurrency: ${limit}\n')
+    with pytest.raises(StepError, match='invalid "_concurrency"'):
+        JobExecutor(description, 'app', 'build', {'limit': 'many'}).execute()
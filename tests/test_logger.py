@@ -0,0 +1,98 @@
+import json
+import logging
+import sys
+
+import pytest
+
+from jobchain import logger as logging_module
+from jobchain.job_executor import JobExecutor
+from jobchain.logger import JsonFormatter, StepFileHandler, add_handler, flush, logger
+
+
+@pytest.fixture
+def handler():
+    """
+    Adds a handler behind the queue, e.g. handler(StepFileHandler(path)), it's removed after the test.
+    """
+    added = []
+
+    def add(h: logging.Handler):
+        added.append(h)
+        add_handler(h)
+        return h
+
+    yield add
+    for h in added:
+        logging_module._handlers.remove(h)
+        h.close()
+    flush()
+
+
+def _record(msg: str, *args, step=None, alias=None, index=None, exc_info=None) -> logging.LogRecord:
+    record = logger.makeRecord(logger.name, logging.INFO, __file__, 1, msg, args, exc_info)
+    record.step, record.alias, record.index = step, alias, index
+    return record
+
+
+def test_message_formatted_when_logged(tmp_path, handler):
+    # the arguments are modified after the call, the record is handled later by the listener thread.
+    handler(StepFileHandler(str(tmp_path)))
+    items = ['a']
+    logger.info('items %s', items)
+    items.append('b')
+    flush()
+    assert "items ['a']\n" in (tmp_path / 'job.log').read_text(encoding='utf-8')
+
+
+def test_step_file_names(tmp_path):
+    file_handler = StepFileHandler(str(tmp_path))
+    try:
+        file_handler.emit(_record('job started'))
+        file_handler.emit(_record('building', step='shell', index=1))
+        file_handler.emit(_record('sending', step='http', alias='notify/team', index=2))
+        file_handler.emit(_record('sent', step='http', alias='notify/team', index=2))
+    finally:
+        file_handler.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['1-shell.log', '2-http.notify_team.log', 'job.log']
+    lines = (tmp_path / '2-http.notify_team.log').read_text(encoding='utf-8').splitlines()
+    assert [line.rsplit(': ', 1)[1] for line in lines] == ['sending', 'sent']
+
+
+def test_step_files_of_job(tmp_path, describe, step, handler):
+    handler(StepFileHandler(str(tmp_path)))
+    step('say', lambda text: logger.info('saying %s', text))
+    JobExecutor(describe('''
+repositories:
+  app:
+    build:
+      say:
+        text: hello
+      say.again:
+        text: bye
+'''), 'app', 'build').execute()
+    flush()
+    assert 'saying hello' in (tmp_path / '1-say.log').read_text(encoding='utf-8')
+    assert 'saying bye' in (tmp_path / '2-say.again.log').read_text(encoding='utf-8')
+
+
+def test_json_fields():
+    entry = json.loads(JsonFormatter().format(_record('took %.1fs', 1.25, step='http', alias='notify', index=2)))
+    assert entry['message'] == 'took 1.2s'
+    assert (entry['level'], entry['logger']) == ('INFO', 'jenkins')
+    assert (entry['step'], entry['alias'], entry['index']) == ('http', 'notify', 2)
+    assert 'exception' not in entry
+    assert json.loads(JsonFormatter().format(_record('done')))['step'] is None
+
+
+def test_json_exception(tmp_path, handler):
+    # the traceback is rendered when the record is queued.
+    json_handler = handler(logging.FileHandler(str(tmp_path / 'log.json'), encoding='utf-8'))
+    json_handler.setFormatter(JsonFormatter())
+    try:
+        raise ValueError('broken')
+    except ValueError:
+        logger.exception('failed %s', 'step', exc_info=sys.exc_info())
+    flush()
+    entry = json.loads((tmp_path / 'log.json').read_text(encoding='utf-8'))
+    assert entry['message'] == 'failed step'
+    assert 'ValueError: broken' in entry['exception']
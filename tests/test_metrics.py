@@ -0,0 +1,66 @@
+import urllib.request
+
+from jobchain._metrics import CONTENT_TYPE, Registry
+
+
+def test_counter_and_histogram():
+    registry = Registry()
+    registry.inc('jobs', 'The jobs.', {'status': 'success'})
+    registry.inc('jobs', 'The jobs.', {'status': 'success'}, 2)
+    registry.observe('duration_seconds', 'The durations.', {'job': 'build'}, 0.3, buckets=(0.1, 0.5, 1))
+    registry.observe('duration_seconds', 'The durations.', {'job': 'build'}, 0.7, buckets=(0.1, 0.5, 1))
+    assert registry.render() == '''# TYPE jobs counter
+# HELP jobs The jobs.
+jobs_total{status="success"} 3
+# TYPE duration_seconds histogram
+# HELP duration_seconds The durations.
+duration_seconds_bucket{job="build",le="0.1"} 0
+duration_seconds_bucket{job="build",le="0.5"} 1
+duration_seconds_bucket{job="build",le="1"} 2
+duration_seconds_bucket{job="build",le="+Inf"} 2
+duration_seconds_sum{job="build"} 1
+duration_seconds_count{job="build"} 2
+# EOF
+'''
+
+
+def test_render_parse_round_trip():
+    registry = Registry()
+    registry.inc('failures', 'The failures.', {'step': 'say "hi"\n'})
+    registry.observe('duration_seconds', '', {}, 2, buckets=(1, 5))
+    parsed = Registry()
+    parsed.parse(registry.render())
+    assert parsed.snapshot() == registry.snapshot()
+    assert parsed.render() == registry.render()
+
+
+def test_write_accumulates(tmp_path):
+    path = str(tmp_path / 'metrics.prom')
+    for _ in range(3):
+        registry = Registry()
+        registry.inc('jobs', 'The jobs.', {'status': 'success'})
+        registry.observe('duration_seconds', 'The durations.', {}, 0.3, buckets=(1,))
+        registry.write(path)
+        # the written samples are reset.
+        assert registry.snapshot() == {}
+    merged = Registry()
+    with open(path, encoding='utf-8') as f:
+        merged.parse(f.read())
+    samples = {(sample, dict(labels).get('le')): value
+               for family in merged.snapshot().values() for (sample, labels), value in family['samples'].items()}
+    assert samples[('jobs_total', None)] == 3 and samples[('duration_seconds_count', None)] == 3
+    assert merged.render().count('duration_seconds_bucket{le="1"} 3') == 1
+    assert merged.render().count('duration_seconds_bucket{le="+Inf"} 3') == 1
+
+
+def test_serve():
+    registry = Registry()
+    registry.inc('jobs', '', {})
+    server = registry.serve(0)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            assert 'jobs_total 1' in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,69 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from jobchain.exception import ProcessError
+from jobchain.process import run, run_all
+
+
+def test_output_and_status():
+    result = run('echo out; echo err >&2; exit 3')
+    assert (result.returncode, result.stdout, result.stderr) == (3, 'out', 'err')
+    with pytest.raises(ProcessError):
+        result.check()
+
+
+def test_list_command():
+    assert run([sys.executable, '-c', 'print("a b")']).check().stdout == 'a b'
+
+
+def test_unbalanced_quotes():
+    # valid for the shell, but not for shlex.
+    result = run("echo it\\'s")
+    assert result.check().stdout == "it's"
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX only')
+def test_limits():
+    assert run('ulimit -n', limits={'files': 64}).check().stdout == '64'
+    assert run(['sh', '-c', 'ulimit -n'], limits={'files': 32}).check().stdout == '32'
+
+
+def test_timeout_kills_the_children():
+    start = time.time()
+    result = run('sleep 30 & sleep 30', timeout=0.5)
+    assert result.timed_out and not result.succeeded
+    assert time.time() - start < 10
+
+
+def test_run_all():
+    assert [r.stdout for r in run_all(['echo 1', 'echo 2'], 2)] == ['1', '2']
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX only')
+def test_terminated_parent_kills_the_commands(tmp_path):
+    pid_file = tmp_path / 'pid'
+    (tmp_path / 'jobs.yaml').write_text(f'''
+repositories:
+  app:
+    build:
+      shell:
+        command: echo $$ > {pid_file}; sleep 30
+''')
+    parent = subprocess.Popen([sys.executable, '-m', 'jobchain', '-f', str(tmp_path / 'jobs.yaml'), '-r', 'app',
+                               '-j', 'build', '--no-cache'], stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.dirname(__file__)))
+    for _ in range(100):
+        if pid_file.exists() and pid_file.read_text().strip():
+            break
+        time.sleep(0.1)
+    pid = int(pid_file.read_text())
+    parent.send_signal(signal.SIGTERM)
+    parent.wait(10)
+    time.sleep(0.2)
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from jobchain._resources import LocalSlots, MachineSlots, Slots, parse_resources
+from jobchain.job_executor import JobExecutor
+
+
+def test_parse_resources():
+    assert parse_resources({'cpu': 2, 'memory': '4G'}) == {'cpu': 2, 'memory': 4 << 30}
+    assert parse_resources('cpu=0.5 memory=512Mi') == {'cpu': 0.5, 'memory': 512 << 20}
+    with pytest.raises(AssertionError):
+        parse_resources({'cpu': 'many'})
+
+
+def test_slots_are_abstract():
+    with pytest.raises(TypeError):
+        Slots({'cpu': 1})
+
+
+@pytest.mark.parametrize('slots', [lambda: LocalSlots({'cpu': 2}), lambda: MachineSlots({'cpu': 2})])
+def test_capacity(slots):
+    slots = slots()
+    running = []
+    peak = []
+
+    def work():
+        with slots.acquire({'cpu': 1}):
+            running.append(None)
+            peak.append(len(running))
+            time.sleep(0.05)
+            running.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(20)
+    assert len(peak) == 6 and max(peak) <= 2
+
+
+def test_oversized_request_runs_alone():
+    slots = LocalSlots({'cpu': 1})
+    with slots.acquire({'cpu': 4}):
+        assert slots._try_acquire({'cpu': 1}) is None
+
+
+def test_job_resources(describe, step):
+    running = []
+    peak = []
+
+    def work():
+        running.append(None)
+        peak.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+
+    step('work', work)
+    description = describe('''
+repositories:
+  app:
+    build:
+      _parallel: 4
+      _resources: {cpu: 2}
+      work.a: {_resources: {cpu: 1}}
+      work.b: {_resources: {cpu: 1}}
+      work.c: {_resources: {cpu: 1}}
+      work.d: {_resources: {cpu: 1}}
+''')
+    JobExecutor(description, 'app', 'build').execute()
+    assert len(peak) == 4 and max(peak) <= 2
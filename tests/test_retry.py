@@ -0,0 +1,99 @@
+import threading
+import time
+import types
+
+import pytest
+
+import jobchain.event as events
+from jobchain.exception import StepError
+from jobchain.job_executor import JobExecutor
+
+
+@pytest.fixture
+def retries(monkeypatch):
+    received = []
+    monkeypatch.setattr(events, 'record', types.SimpleNamespace(run=lambda **args: received.append(args)),
+                        raising=False)
+    return received
+
+
+def test_retry(describe, step, retries):
+    calls = []
+    results = []
+
+    def flaky():
+        calls.append(time.perf_counter())
+        if len(calls) < 3:
+            raise RuntimeError(f'failure {len(calls)}')
+        return 'done'
+
+    step('flaky', flaky)
+    step('collect', lambda result, attempts: results.append((result, attempts)))
+    description = describe('''
+repositories:
+  app:
+    build:
+      flaky:
+        _retry: ${retry}
+        _backoff: ${backoff}
+        _on_retry:
+          name: record
+          args:
+            attempt: ${.attempt}
+            error: ${.error}
+      collect:
+        result: ${1}
+        attempts: ${0.attempts.flaky}
+''')
+    JobExecutor(description, 'app', 'build', {'retry': '3', 'backoff': '0.01'}).execute()
+    assert len(calls) == 3
+    # the delays are bounded by _backoff * 2^(n-1).
+    assert calls[2] - calls[0] < 0.5
+    assert [(r['attempt'], str(r['error'])) for r in retries] == [(1, 'failure 1'), (2, 'failure 2')]
+    result, attempts = results[0]
+    assert result == 'done'
+    assert [(a['attempt'], a['error'], a['hedged']) for a in attempts] == [
+        (1, 'failure 1', False), (2, 'failure 2', False), (3, None, False)]
+
+
+def test_retries_exhausted(describe, step):
+    def broken():
+        raise RuntimeError('broken')
+
+    step('broken', broken)
+    description = describe('repositories:\n  app:\n    build:\n      broken:\n        _retry: 1\n        _backoff: 0\n')
+    with pytest.raises(StepError) as e:
+        JobExecutor(description, 'app', 'build').execute()
+    assert [a['error'] for a in e.value.attempts] == ['broken', 'broken']
+
+
+def test_hedge_after(describe, step):
+    calls = []
+    lock = threading.Lock()
+    results = []
+
+    def slow_once():
+        with lock:
+            calls.append(None)
+            first = len(calls) == 1
+        if first:
+            time.sleep(2)
+        return 'first' if first else 'hedged'
+
+    step('slow', slow_once)
+    step('collect', lambda result, attempts: results.append((result, attempts)))
+    description = describe('''
+repositories:
+  app:
+    build:
+      slow:
+        _hedge_after: ${hedge_after}
+      collect:
+        result: ${1}
+        attempts: ${0.attempts.slow}
+''')
+    start = time.perf_counter()
+    JobExecutor(description, 'app', 'build', {'hedge_after': '0.1'}).execute()
+    assert time.perf_counter() - start < 1.5
+    result, attempts = results[0]
+    assert result == 'hedged' and attempts[0]['hedged'] is True
@@ -0,0 +1,81 @@
+import subprocess
+import sys
+import textwrap
+
+from jobchain import _spill, job_executor
+from jobchain._spill import SpillStore, Spilled, loading_scope
+from jobchain.job_executor import JobExecutor
+
+
+def test_loaded_once_in_scope():
+    store = SpillStore()
+    spilled = store.spill('1', {'items': list(range(10))})
+    with loading_scope():
+        first = spilled.load()
+        assert spilled.load() is first
+    assert spilled.load() == first and spilled.load() is not first
+
+
+def test_kept_in_memory_if_not_written(monkeypatch):
+    def full(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(_spill.tempfile, 'mkdtemp', full)
+    assert SpillStore().spill('1', [1, 2, 3]) is None
+
+
+def test_unpicklable():
+    assert SpillStore().spill('1', lambda: None) is None
+
+
+def test_spilled_and_released_in_job(describe, step, monkeypatch):
+    # the result of 'produce' is spilled, read back by 'consume' (its last consumer), then released.
+    monkeypatch.setattr(job_executor, 'SPILL_THRESHOLD', 1024)
+    seen = {}
+    step('produce', lambda: {'result': list(range(1000))})
+    step('consume', lambda items: seen.update(spilled=isinstance(executor._context.get('$1'), Spilled), items=items))
+    step('after', lambda: seen.update(released='$1' not in executor._context))
+    description = describe('''
+repositories:
+  app:
+    build:
+      produce:
+      consume:
+        items: ${1.result}
+      after:
+''')
+    executor = JobExecutor(description, 'app', 'build')
+    executor.execute()
+    assert seen == {'spilled': True, 'items': list(range(1000)), 'released': True}
+
+
+def test_liveness_without_importing_steps(tmp_path):
+    # the step 'shell' never runs, the liveness analysis MUST NOT import it.
+    path = tmp_path / 'jobs.yaml'
+    path.write_text(textwrap.dedent('''
+        repositories:
+          app:
+            build:
+              never:
+              shell:
+                command: echo ${1}
+    '''), encoding='utf-8')
+    code = textwrap.dedent(f'''
+        import sys, types
+        import jobchain.step as steps
+        from jobchain.job_description import JobDescription
+        from jobchain.job_executor import JobExecutor
+
+        def fail():
+            raise RuntimeError('broken')
+
+        steps.never = types.SimpleNamespace(run=fail)
+        executor = JobExecutor(JobDescription({str(path)!r}, cache=False), 'app', 'build')
+        try:
+            executor.execute()
+        except Exception:
+            pass
+        print(executor._liveness is not None, 'jobchain.step.shell' in sys.modules)
+    ''')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert out.split() == ['True', 'False']
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from jobchain._stream import Stream, DEFAULT_BUFFER
+from jobchain.job_executor import JobExecutor
+
+JOBS = '''
+repositories:
+  app:
+    twice:
+      numbers:
+        count: 5000
+      pair:
+        left: ${1}
+        right: ${1}
+    skipped:
+      numbers:
+        count: 5000
+      total:
+        items: ${1}
+      total.never:
+        _condition: ${never}
+        items: ${1}
+    mapped:
+      numbers:
+        count: 5000
+      double:
+        items: ${1}
+      total:
+        items: ${2}
+variable:
+  never:
+    value: false
+'''
+
+
+def _execute(executor, *args):
+    # a deadlock fails the test instead of hanging it.
+    errors = []
+    worker = threading.Thread(target=lambda: _run(executor, errors, *args), daemon=True)
+    worker.start()
+    worker.join(20)
+    assert not worker.is_alive(), 'the job is deadlocked'
+    if errors:
+        raise errors[0]
+
+
+def _run(executor, errors, *args):
+    try:
+        executor.execute(*args)
+    except Exception as e:
+        errors.append(e)
+
+
+@pytest.fixture
+def jobs(describe, step):
+    results = {}
+    step('numbers', lambda count: iter(range(count)))
+    step('pair', lambda left, right: results.setdefault('pair', (sum(left), sum(right))))
+    step('total', lambda items: results.setdefault('total', sum(items)))
+    step('double', lambda items: (item * 2 for item in items))
+    return describe(JOBS), results
+
+
+@pytest.mark.parametrize('parallel', [None, 2])
+def test_subscribed_twice_by_one_step(jobs, parallel):
+    description, results = jobs
+    _execute(JobExecutor(description, 'app', 'twice'), parallel)
+    assert results['pair'] == (sum(range(5000)), sum(range(5000)))
+
+
+def test_skipped_subscriber_is_not_buffered_for(jobs):
+    description, results = jobs
+    executor = JobExecutor(description, 'app', 'skipped', {'never': False})
+    executor._job = dict(executor._job, _keep_results=True)
+    _execute(executor)
+    assert results['total'] == sum(range(5000))
+    assert len(executor._context['$1']._items) == 0
+
+
+def test_returned_iterator_consumes_lazily(jobs):
+    description, results = jobs
+    _execute(JobExecutor(description, 'app', 'mapped'))
+    assert results['total'] == 2 * sum(range(5000))
+
+
+def test_backpressure_between_threads():
+    stream = Stream('$1', iter(range(10000)), 2, buffer=10)
+    first, second = stream.subscribe(), stream.subscribe()
+    sizes = []
+
+    def consume(subscription):
+        with subscription:
+            for _ in subscription:
+                sizes.append(len(stream._items))
+
+    threads = [threading.Thread(target=consume, args=(s,)) for s in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(20)
+    assert len(sizes) == 20000
+    assert max(sizes) <= 11
+
+
+def test_closed_subscription_releases_items():
+    stream = Stream('$1', iter(range(3 * DEFAULT_BUFFER)), 2)
+    first, second = stream.subscribe(), stream.subscribe()
+    second.close()
+    assert sum(first) == sum(range(3 * DEFAULT_BUFFER))
+    assert len(stream._items) == 0
+    assert list(second) == []
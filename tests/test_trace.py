@@ -0,0 +1,37 @@
+import json
+import types
+
+import jobchain.event as events
+from jobchain import cli
+
+
+def test_profile_spans(tmp_path, step, monkeypatch):
+    monkeypatch.setattr(events, 'record', types.SimpleNamespace(run=lambda value: None), raising=False)
+    step('echo', lambda value: value)
+    jobs = tmp_path / 'jobs.yaml'
+    jobs.write_text('''
+repositories:
+  app:
+    build:
+      _on_success:
+        name: record
+        args:
+          value: ${2}
+      echo:
+        value: first
+      echo.second:
+        _condition: $eval(True);
+        value: ${1}-second
+''', encoding='utf-8')
+    profile = tmp_path / 'trace.json'
+    cli._execute(file=str(jobs), repository='app', job='build', profile=str(profile), no_cache=True)
+    trace = json.loads(profile.read_text(encoding='utf-8'))
+    spans = [(event['cat'], event['name']) for event in trace['traceEvents']]
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in trace['traceEvents'])
+    assert spans.count(('job', 'app:build')) == 1
+    assert [name for category, name in spans if category == 'step'] == ['echo', 'echo.second']
+    # a span per phase of each step, and one per event handler.
+    assert spans.count(('resolve', 'resolve')) == 2
+    assert spans.count(('condition', 'condition')) == 2
+    assert spans.count(('run', 'run')) == 2
+    assert ('handler', 'on_success record') in spans
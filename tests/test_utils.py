@@ -0,0 +1,44 @@
+import pytest
+import requests
+
+from jobchain import _utils
+from jobchain._utils import compile_path, read_data
+from tests.stub_server import StubServer
+
+TEMPLATES = 'template:\n  checkout:\n    branch: develop\n'
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(*responses):
+        servers.append(StubServer(responses))
+        return servers[-1]
+
+    yield start
+    for stub in servers:
+        stub.close()
+
+
+def test_fetch_uses_cached_on_server_error(server):
+    stub = server((200, TEMPLATES, {'ETag': '"v1"'}), (503, 'unavailable'))
+    url = stub.url.replace('/robot/send', '/templates.yaml')
+    assert read_data(url) == TEMPLATES
+    assert read_data(url) == TEMPLATES
+    assert len(stub.requests) == 2
+
+
+def test_fetch_client_error_not_recovered(server):
+    stub = server((200, TEMPLATES, {'ETag': '"v1"'}), (404, 'not found'))
+    url = stub.url.replace('/robot/send', '/removed.yaml')
+    read_data(url)
+    with pytest.raises(requests.HTTPError):
+        read_data(url)
+
+
+def test_path_accessors_bounded():
+    assert compile_path(['$1', 'a']) is compile_path(('$1', 'a'))
+    assert compile_path(['$1', 'a'])({'$1': {'a': 1}}) == 1
+    # the accessors of the paths built at runtime MUST NOT grow without limit.
+    assert _utils._compile_path.cache_info().maxsize == _utils.PATH_CACHE_SIZE
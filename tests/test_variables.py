@@ -0,0 +1,76 @@
+import types
+
+import pytest
+
+import jobchain.function as functions
+from jobchain._variables import Variables
+from jobchain.exception import ParseError, StepError
+from jobchain.job_executor import JobExecutor
+
+
+@pytest.fixture
+def function(monkeypatch):
+    """
+    Registers a function, e.g. function('upper', lambda value: value.upper()).
+    """
+    def register(name: str, run):
+        monkeypatch.setattr(functions, name, types.SimpleNamespace(run=run), raising=False)
+
+    return register
+
+
+def test_circular_reference():
+    definitions = {'first': {'value': 'second'}, 'second': {'value': 'third'}, 'third': {'value': 'first'}}
+    variables = Variables(definitions, {}, lambda name, definition: variables[definition['value']])
+    with pytest.raises(ParseError) as e:
+        variables['first']
+    assert e.value.message == 'circular reference first -> second -> third -> first'
+    assert variables.resolved() == {}
+
+
+def test_circular_reference_in_job(describe, step):
+    step('echo', lambda value: value)
+    description = describe('''
+variable:
+  first:
+    value: ${second}
+  second:
+    value: ${first}
+repositories:
+  app:
+    build:
+      echo:
+        value: v-${first}
+''')
+    with pytest.raises(StepError) as e:
+        JobExecutor(description, 'app', 'build').execute()
+    assert 'circular reference first -> second -> first' in e.value.message
+
+
+def test_unused_variables_not_resolved(describe, step, function):
+    calls = []
+    function('count', lambda value: calls.append(value) or value)
+    function('boom', lambda value: 1 / 0)
+    step('echo', lambda value: value)
+    description = describe('''
+variable:
+  used:
+    parser: "$count({});"
+    value: a
+  unused:
+    parser: "$count({});"
+    value: b
+  broken:
+    parser: "$boom({});"
+    value: c
+repositories:
+  app:
+    build:
+      echo:
+        value: ${used}-${used}
+''')
+    executor = JobExecutor(description, 'app', 'build')
+    executor.execute()
+    # the used variable is parsed once, the other ones never, so the broken one doesn't fail the job.
+    assert calls == ['a']
+    assert executor._context['variables'].resolved() == {'used': 'a'}
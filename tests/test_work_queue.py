@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from jobchain import work_queue
+from jobchain.work_queue import WorkQueue, open_queue, work, wait
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return open_queue(f'sqlite://{tmp_path / "queue.db"}')
+
+
+def test_backend_must_implement_the_interface():
+    class Incomplete(WorkQueue):
+        def put(self, run, max_attempts=3):
+            return 1
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_lease_and_complete(queue):
+    first = queue.put({'job': 'a'})
+    second = queue.put({'job': 'b'})
+    task = queue.lease('w1', 60)
+    assert (task.id, task.run, task.attempts) == (first, {'job': 'a'}, 1)
+    assert queue.heartbeat(task.id, 'w1', 60)
+    assert not queue.heartbeat(task.id, 'w2', 60)
+    queue.complete(task.id, 'w1')
+    assert queue.unfinished() == 1
+    assert [s['status'] for s in queue.status([second, first])] == ['succeeded', 'pending']
+
+
+def test_lost_worker(queue):
+    task_id = queue.put({'job': 'a'}, max_attempts=2)
+    assert queue.lease('lost', 0.01).attempts == 1
+    time.sleep(0.05)
+    task = queue.lease('w2', 0.01)
+    assert (task.id, task.attempts) == (task_id, 2)
+    time.sleep(0.05)
+    assert queue.lease('w3', 60) is None
+    status, = queue.status([task_id])
+    assert (status['status'], status['error']) == ('failed', 'the worker was lost')
+    # the lost worker can't complete the task leased by the others.
+    queue.complete(task_id, 'lost')
+    assert queue.status([task_id])[0]['status'] == 'failed'
+
+
+def test_prune(queue):
+    finished = queue.put({'job': 'a'})
+    pending = queue.put({'job': 'b'})
+    queue.complete(queue.lease('w1', 60).id, 'w1', 'broken')
+    assert queue.prune(3600) == 0
+    time.sleep(0.05)
+    assert queue.prune(0.01) == 1
+    assert [s['id'] for s in queue.status()] == [pending]
+    assert queue.status([finished]) == []
+
+
+def test_work_and_wait(queue, describe, step, tmp_path):
+    step('echo', lambda value: value)
+    step('fail', lambda: 1 / 0)
+    describe('''
+repositories:
+  app:
+    ok:
+      echo:
+        value: ${value}
+    broken:
+      fail:
+''')
+    file = str(tmp_path / 'jobs.yaml')
+    ids = [queue.put({'file': file, 'repository': 'app', 'job': job, 'e': {'value': 1}}) for job in ('ok', 'broken')]
+    work(queue, lease_seconds=5, poll_seconds=0.01, drain=True)
+    statuses = wait(queue, ids, poll_seconds=0.01)
+    assert [s['status'] for s in statuses] == ['succeeded', 'failed']
+    assert 'division by zero' in statuses[1]['error']
+
+
+def test_open_unknown_backend():
+    with pytest.raises(AssertionError):
+        open_queue('unknown://somewhere')
+    assert work_queue.BACKENDS['sqlite'] is work_queue.SQLiteWorkQueue